@@ -12,16 +12,30 @@ from .client import (
     RetryClient,
     CrawlerClient,
     WebClient,
-    ImageClient
+    ImageClient,
+    DownloadClient,
+    RevalidatingClient,
+    CacheEntry,
+    RateLimitClient,
+    AdaptiveClient,
+    MetricsClient,
+    ParseClient
 )
 
 from .cache import (
     Cache,
-    FileCache
+    FileCache,
+    SegmentCache,
+    AsyncCache,
+    InlineCache,
+    ExecutorCache,
+    AsyncFileCache,
+    WriteBehindCache
 )
 
 from .session import (
     ProxyPool,
+    ProxyStats,
     SessionPool,
     SingleSessionPool,
     ProxySessionPool
@@ -29,8 +43,55 @@ from .session import (
 
 from .worker import (
     Dispatcher,
+    HostDispatcher,
+    JournalDispatcher,
     Worker,
     Master,
+    ProcessMaster,
     CrawlerWorker,
     SimpleWorker
 )
+
+from .pipeline import (
+    Pipeline,
+    StageStats
+)
+
+from .dedup import (
+    FingerprintSet,
+    BloomFilter
+)
+
+from .limit import (
+    TokenBucket,
+    HostLimit,
+    HostLimiter,
+    AdaptiveLimiter,
+    RetryBudget
+)
+
+from .serializer import (
+    Serializer,
+    DecodeError,
+    PickleSerializer,
+    JSONSerializer,
+    RawSerializer,
+    ZlibSerializer,
+    ZstdSerializer
+)
+
+from .tracing import (
+    RequestTimings,
+    PhaseStats
+)
+
+from .metrics import (
+    Registry,
+    NullRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    HistogramValue,
+    track_dispatcher,
+    metrics_handler
+)
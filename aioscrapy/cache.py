@@ -2,11 +2,22 @@
 Data storage
 """
 
+import asyncio
 import hashlib
+import mmap
 import os
 import abc
-import pickle
-from typing import Generic
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import (
+    Generic, Optional, Union, Dict, Tuple, BinaryIO, Callable, List,
+    Iterable, Mapping)
+from .serializer import Serializer, PickleSerializer, DecodeError
 from .typedefs import VT, KT
 
 
@@ -27,16 +38,42 @@ class Cache(abc.ABC, Generic[KT, VT]):
         Raises OSError
         """
 
+    def get_many(self, keys: Iterable[KT]) -> Dict[KT, VT]:
+        """
+        Returns found keys only, missing keys are left out.
+        :param keys:
+        :return:
+        """
+        result = {}
+        for key in keys:
+            try:
+                result[key] = self.get(key)
+            except LookupError:
+                pass
+        return result
+
+    def set_many(self, items: Mapping[KT, VT]) -> None:
+        """
+        Raises OSError
+        """
+        for key, val in items.items():
+            self.set(key, val)
+
 
 class FileCache(Cache[str, VT]):
     """
     Store data into folder in following structure
     BASE_FOLDER/ab/abcdef1234567890abcdef1234567890
     where abcdef1234567890abcdef1234567890 is md5(key)
+
+    Values are pickled unless another `serializer` is given,
+    values which cannot be decoded are treated as missing.
     """
 
-    def __init__(self, folder: str):
+    def __init__(self, folder: str,
+                 serializer: Optional[Serializer] = None):
         self._folder = folder
+        self._serializer = serializer or PickleSerializer()
 
     def get(self, key: str) -> VT:
         """
@@ -47,10 +84,15 @@ class FileCache(Cache[str, VT]):
         try:
             path = self._full_path(key)
             with open(path, 'rb') as file:
-                return pickle.load(file)
+                data = file.read()
         except OSError:
             raise LookupError
 
+        try:
+            return self._serializer.loads(data)
+        except DecodeError:
+            raise LookupError
+
     def set(self, key: str, val: VT) -> None:
         """
 
@@ -58,12 +100,18 @@ class FileCache(Cache[str, VT]):
         :param val:
         :return:
         """
+        data = self._serializer.dumps(val)
         path = self._full_path(key)
-        directory = os.path.dirname(path)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        with open(path, 'wb') as file:
-            pickle.dump(val, file, pickle.HIGHEST_PROTOCOL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
     def _full_path(self, key: str) -> str:
         """
@@ -75,13 +123,313 @@ class FileCache(Cache[str, VT]):
         return os.path.join(self._folder, md5[:2], md5)
 
 
+class SegmentCache(Cache[str, VT]):
+    """
+    Store data into large append-only segment files
+    BASE_FOLDER/00000001.seg, BASE_FOLDER/00000002.seg, ...
+
+    Every record is crc32, key length, value length, key and value.
+    The index from key to (segment, offset, length) is kept in memory
+    and rebuilt by scanning segments on start.
+    Values are read through mmap, overwritten records are dropped
+    by compact(). Values are pickled unless another `serializer` is given,
+    values which cannot be decoded are treated as missing.
+    """
+
+    HEADER = struct.Struct('<III')
+    SUFFIX = '.seg'
+
+    def __init__(self, folder: str, segment_size: int = 256 * 1024 * 1024,
+                 serializer: Optional[Serializer] = None):
+        self._folder = folder
+        self._segment_size = segment_size
+        self._serializer = serializer or PickleSerializer()
+        self._lock = threading.RLock()
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        self._sizes: Dict[int, int] = {}
+        self._garbage = 0
+        self._maps: Dict[int, mmap.mmap] = {}
+        os.makedirs(folder, exist_ok=True)
+        segments = sorted(
+            int(name[:-len(self.SUFFIX)]) for name in os.listdir(folder)
+            if name.endswith(self.SUFFIX))
+        for segment in segments:
+            self._load(segment, segment == segments[-1])
+        self._active = max(self._sizes, default=0)
+        self._file: Optional[BinaryIO] = None
+        self._open_active()
+
+    def get(self, key: str) -> VT:
+        """
+
+        :param key:
+        :return:
+        """
+        with self._lock:
+            try:
+                segment, offset, length = self._index[key]
+            except KeyError:
+                raise LookupError
+            data = self._map(segment, offset + length)
+            with memoryview(data) as view:
+                with view[offset:offset + length] as chunk:
+                    try:
+                        return self._serializer.loads(chunk)
+                    except DecodeError:
+                        raise LookupError
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, VT]:
+        """
+        Takes the lock once for all keys.
+        :param keys:
+        :return:
+        """
+        with self._lock:
+            return super().get_many(keys)
+
+    def set(self, key: str, val: VT) -> None:
+        """
+
+        :param key:
+        :param val:
+        :return:
+        """
+        self.set_many({key: val})
+
+    def set_many(self, items: Mapping[str, VT]) -> None:
+        """
+        Appends all records with one flush.
+        :param items:
+        :return:
+        """
+        values = [
+            (key, self._serializer.dumps(val)) for key, val in items.items()
+        ]
+        with self._lock:
+            try:
+                for key, value in values:
+                    if self._sizes[self._active] >= self._segment_size:
+                        self._roll()
+                    self._append(key, value)
+            finally:
+                if self._file is not None:
+                    self._file.flush()
+
+    def compact(self) -> None:
+        """
+        Rewrites live records into new segments and removes old ones.
+        :return:
+        """
+        with self._lock:
+            old_segments = set(self._sizes)
+            self._roll()
+            for key, (segment, offset, length) in list(self._index.items()):
+                if segment in old_segments:
+                    data = self._map(segment, offset + length)
+                    value = data[offset:offset + length]
+                    if self._sizes[self._active] >= self._segment_size:
+                        self._roll()
+                    self._append(key, value)
+            if self._file is not None:
+                self._file.flush()
+            for segment in old_segments:
+                self._unmap(segment)
+                del self._sizes[segment]
+                os.remove(self._path(segment))
+            self._garbage = 0
+
+    def garbage(self) -> float:
+        """
+        Share of segment bytes taken by overwritten records.
+        :return:
+        """
+        total = sum(self._sizes.values())
+        return self._garbage / total if total else 0.0
+
+    def close(self) -> None:
+        """
+
+        :return:
+        """
+        with self._lock:
+            for segment in list(self._maps):
+                self._unmap(segment)
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _append(self, key: str, value: bytes) -> None:
+        """
+
+        :param key:
+        :param value:
+        :return:
+        """
+        assert self._file is not None
+        key_bytes = key.encode()
+        header = self.HEADER.pack(
+            zlib.crc32(value, zlib.crc32(key_bytes)),
+            len(key_bytes), len(value))
+        self._file.write(header + key_bytes + value)
+        offset = self._sizes[self._active] + len(header) + len(key_bytes)
+        self._index_record(key, self._active, offset, len(value))
+        self._sizes[self._active] = offset + len(value)
+
+    def _index_record(self, key: str, segment: int,
+                      offset: int, length: int) -> None:
+        """
+
+        :param key:
+        :param segment:
+        :param offset:
+        :param length:
+        :return:
+        """
+        previous = self._index.get(key)
+        if previous is not None:
+            self._garbage += (self.HEADER.size + len(key.encode())
+                              + previous[2])
+        self._index[key] = (segment, offset, length)
+
+    def _load(self, segment: int, active: bool) -> None:
+        """
+        Indexes records of segment.
+
+        Only the active (last) segment may have a torn tail,
+        it is truncated. In sealed segments records with a bad
+        checksum are skipped and counted as garbage.
+        :param segment:
+        :param active:
+        :return:
+        """
+        path = self._path(segment)
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            position = self._scan(file, segment, size, active)
+        if active and position < size:
+            os.truncate(path, position)
+            size = position
+        self._garbage += size - position
+        self._sizes[segment] = size
+
+    def _scan(self, file: BinaryIO, segment: int, size: int,
+              active: bool) -> int:
+        """
+        Indexes records through mmap, returns where the scan stopped.
+        :param file:
+        :param segment:
+        :param size:
+        :param active:
+        :return:
+        """
+        if not size:
+            return 0
+        position = 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            with memoryview(data) as view:
+                while position + self.HEADER.size <= size:
+                    crc, key_length, length = \
+                        self.HEADER.unpack_from(view, position)
+                    key_offset = position + self.HEADER.size
+                    offset = key_offset + key_length
+                    end = offset + length
+                    if end > size:
+                        break
+                    key_bytes = bytes(view[key_offset:offset])
+                    with view[offset:end] as value:
+                        valid = zlib.crc32(
+                            value, zlib.crc32(key_bytes)) == crc
+                    if valid:
+                        self._index_record(
+                            key_bytes.decode(), segment, offset, length)
+                    elif active:
+                        break
+                    else:
+                        self._garbage += end - position
+                    position = end
+        return position
+
+    def _open_active(self) -> None:
+        """
+
+        :return:
+        """
+        self._sizes.setdefault(self._active, 0)
+        self._file = open(self._path(self._active), 'ab')
+
+    def _roll(self) -> None:
+        """
+        Starts new segment.
+        :return:
+        """
+        if self._file is not None:
+            self._file.close()
+        self._active += 1
+        self._open_active()
+
+    def _map(self, segment: int, size: int) -> mmap.mmap:
+        """
+        Returns mmap of segment which covers at least `size` bytes.
+        :param segment:
+        :param size:
+        :return:
+        """
+        data = self._maps.get(segment)
+        if data is None or len(data) < size:
+            self._unmap(segment)
+            with open(self._path(segment), 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = data
+        return data
+
+    def _unmap(self, segment: int) -> None:
+        """
+
+        :param segment:
+        :return:
+        """
+        data = self._maps.pop(segment, None)
+        if data is not None:
+            data.close()
+
+    def _path(self, segment: int) -> str:
+        """
+
+        :param segment:
+        :return:
+        """
+        return os.path.join(self._folder, f'{segment:08d}{self.SUFFIX}')
+
+
 class MemoryCache(Cache[KT, VT]):
     """
     Store data into dict
+
+    With `max_entries` or `max_bytes` least recently used entries are
+    evicted, entries older than `ttl` seconds are treated as missing.
+    Size of value is measured by `sizeof`, sys.getsizeof by default.
     """
 
-    def __init__(self):
-        self._cache = {}
+    def __init__(self, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None,
+                 ttl: Optional[float] = None,
+                 sizeof: Callable[[VT], int] = sys.getsizeof):
+        self._cache: 'OrderedDict[KT, Tuple[VT, int, Optional[float]]]' = \
+            OrderedDict()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._sizeof = sizeof
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def get(self, key: KT) -> VT:
         """
@@ -89,13 +437,377 @@ class MemoryCache(Cache[KT, VT]):
         :param key:
         :return:
         """
-        return self._cache[key]
+        try:
+            val, _, expires = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        if expires is not None and expires <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            raise KeyError(key)
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return val
 
-    def set(self, key: KT, val: VT) -> None:
+    def set(self, key: KT, val: VT, ttl: Optional[float] = None) -> None:
         """
 
         :param key:
         :param val:
+        :param ttl: overrides default ttl
+        :return:
+        """
+        if key in self._cache:
+            self._remove(key)
+        size = self._sizeof(val) if self._max_bytes is not None else 0
+        if self._max_bytes is not None and size > self._max_bytes:
+            return
+        ttl = self._ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        self._cache[key] = (val, size, expires)
+        self._bytes += size
+        while (self._max_entries is not None
+               and len(self._cache) > self._max_entries) \
+                or (self._max_bytes is not None
+                    and self._bytes > self._max_bytes):
+            self._remove(next(iter(self._cache)))
+            self.evictions += 1
+
+    @property
+    def size(self) -> int:
+        """
+        Total size of stored values in bytes, 0 without max_bytes.
+        :return:
+        """
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def _remove(self, key: KT) -> None:
+        """
+
+        :param key:
         :return:
         """
-        self._cache[key] = val
+        _, size, _ = self._cache.pop(key)
+        self._bytes -= size
+
+
+class AsyncCache(abc.ABC, Generic[KT, VT]):
+    """
+    Asynchronous cache interface
+    """
+
+    @abc.abstractmethod
+    async def get(self, key: KT) -> VT:
+        """
+        Raises LookupError
+        """
+
+    @abc.abstractmethod
+    async def set(self, key: KT, val: VT) -> None:
+        """
+        Raises OSError
+        """
+
+    async def get_many(self, keys: Iterable[KT]) -> Dict[KT, VT]:
+        """
+        Returns found keys only, missing keys are left out.
+        :param keys:
+        :return:
+        """
+        keys = list(keys)
+        values = await asyncio.gather(
+            *[self.get(key) for key in keys], return_exceptions=True)
+        result = {}
+        for key, val in zip(keys, values):
+            if isinstance(val, LookupError):
+                continue
+            if isinstance(val, BaseException):
+                raise val
+            result[key] = val
+        return result
+
+    async def set_many(self, items: Mapping[KT, VT]) -> None:
+        """
+        Raises OSError
+        """
+        await asyncio.gather(
+            *[self.set(key, val) for key, val in items.items()])
+
+
+class InlineCache(AsyncCache[KT, VT]):
+    """
+    Calls synchronous Cache directly in the event loop.
+
+    Suitable for caches which do not block, like MemoryCache.
+    """
+
+    def __init__(self, cache: Cache[KT, VT]):
+        self._cache = cache
+
+    async def get(self, key: KT) -> VT:
+        """
+
+        :param key:
+        :return:
+        """
+        return self._cache.get(key)
+
+    async def set(self, key: KT, val: VT) -> None:
+        """
+
+        :param key:
+        :param val:
+        :return:
+        """
+        self._cache.set(key, val)
+
+    async def get_many(self, keys: Iterable[KT]) -> Dict[KT, VT]:
+        """
+
+        :param keys:
+        :return:
+        """
+        return self._cache.get_many(keys)
+
+    async def set_many(self, items: Mapping[KT, VT]) -> None:
+        """
+
+        :param items:
+        :return:
+        """
+        self._cache.set_many(items)
+
+
+class ExecutorCache(AsyncCache[KT, VT]):
+    """
+    Runs synchronous Cache in a thread pool,
+    so disk I/O and (de)serialization do not block the event loop.
+    """
+
+    def __init__(self, cache: Cache[KT, VT], max_workers: int = 4,
+                 executor: Optional[Executor] = None):
+        self._cache = cache
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers)
+
+    async def get(self, key: KT) -> VT:
+        """
+
+        :param key:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._cache.get, key)
+
+    async def set(self, key: KT, val: VT) -> None:
+        """
+
+        :param key:
+        :param val:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor, self._cache.set, key, val)
+
+    async def get_many(self, keys: Iterable[KT]) -> Dict[KT, VT]:
+        """
+        Looks up all keys in one executor call.
+        :param keys:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._cache.get_many, list(keys))
+
+    async def set_many(self, items: Mapping[KT, VT]) -> None:
+        """
+        Writes all items in one executor call.
+        :param items:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            self._executor, self._cache.set_many, dict(items))
+
+    def close(self) -> None:
+        """
+        Shuts down own thread pool.
+        :return:
+        """
+        if self._own_executor:
+            self._executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AsyncFileCache(ExecutorCache[str, VT]):
+    """
+    FileCache running in a thread pool
+    """
+
+    def __init__(self, folder: str, max_workers: int = 4,
+                 serializer: Optional[Serializer] = None):
+        super().__init__(FileCache(folder, serializer), max_workers)
+
+
+class WriteBehindCache(AsyncCache[KT, VT]):
+    """
+    Returns from set() at once and writes values to underlying cache
+    in background, up to `batch_size` keys with one set_many() call.
+
+    set() waits only when `max_pending` writes are queued.
+    Failed writes are collected in `errors` and raised by flush().
+    """
+
+    def __init__(self, cache: Union[Cache[KT, VT], AsyncCache[KT, VT]],
+                 batch_size: int = 100, max_pending: int = 1000):
+        self._cache = to_async(cache)
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._pending: Dict[KT, VT] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Future] = None
+        self.errors: List[Tuple[KT, Exception]] = []
+
+    async def get(self, key: KT) -> VT:
+        """
+
+        :param key:
+        :return:
+        """
+        if key in self._pending:
+            return self._pending[key]
+        return await self._cache.get(key)
+
+    async def get_many(self, keys: Iterable[KT]) -> Dict[KT, VT]:
+        """
+
+        :param keys:
+        :return:
+        """
+        result = {}
+        missing = []
+        for key in keys:
+            if key in self._pending:
+                result[key] = self._pending[key]
+            else:
+                missing.append(key)
+        if missing:
+            result.update(await self._cache.get_many(missing))
+        return result
+
+    async def set(self, key: KT, val: VT) -> None:
+        """
+
+        :param key:
+        :param val:
+        :return:
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue(self._max_pending)
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._write_loop())
+        self._pending[key] = val
+        await self._queue.put(key)
+
+    async def set_many(self, items: Mapping[KT, VT]) -> None:
+        """
+
+        :param items:
+        :return:
+        """
+        for key, val in items.items():
+            await self.set(key, val)
+
+    async def flush(self) -> None:
+        """
+        Waits for queued writes.
+
+        Raises OSError if any write failed since last flush.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+        if self.errors:
+            errors, self.errors = self.errors, []
+            key, error = errors[0]
+            raise OSError(
+                f"{len(errors)} writes failed, first '{key}': {error!r}")
+
+    async def close(self) -> None:
+        """
+        Flushes and stops background writer.
+        :return:
+        """
+        try:
+            await self.flush()
+        finally:
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def _write_loop(self) -> None:
+        """
+
+        :return:
+        """
+        assert self._queue is not None
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._write({
+                key: self._pending[key]
+                for key in batch if key in self._pending
+            })
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _write(self, items: Dict[KT, VT]) -> None:
+        """
+        If the batch fails keys are written one by one,
+        so one bad key does not lose the others.
+        :param items:
+        :return:
+        """
+        if not items:
+            return
+        try:
+            await self._cache.set_many(items)
+        except Exception:  # pylint: disable=broad-except
+            for key, val in items.items():
+                try:
+                    await self._cache.set(key, val)
+                except Exception as exc:  # pylint: disable=broad-except
+                    self.errors.append((key, exc))
+        finally:
+            for key, val in items.items():
+                if self._pending.get(key) is val:
+                    del self._pending[key]
+
+
+def to_async(cache: Union[Cache[KT, VT], AsyncCache[KT, VT]]) \
+        -> AsyncCache[KT, VT]:
+    """
+    Wraps synchronous Cache into InlineCache.
+    :param cache:
+    :return:
+    """
+    if isinstance(cache, AsyncCache):
+        return cache
+    return InlineCache(cache)
@@ -1,18 +1,44 @@
 """
 Client
 """
+import asyncio
+import contextlib
+import functools
+import hashlib
+import itertools
+import os
+import random
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Generic, Tuple, Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor, BrokenExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import (
+    Generic, Tuple, Iterable, Union, Dict, Optional, Callable, Any,
+    Awaitable, NamedTuple)
+from urllib.parse import urlsplit
 from http import HTTPStatus
 from aiohttp import (
     ClientResponse, ClientError,
     ClientHttpProxyError, ClientProxyConnectionError)
 
-from .cache import Cache
+from .cache import Cache, AsyncCache, to_async
+from .limit import HostLimit, HostLimiter, AdaptiveLimiter, RetryBudget
+from .metrics import Registry, registry_or_null
 from .typedefs import KT, VT
 from .session import SessionPool
 
 
+def url_host(key: str) -> str:
+    """
+    Returns host part of URL.
+    :param key:
+    :return:
+    """
+    return urlsplit(key).netloc
+
+
 class FetchError(Exception):
     """
     FetchError
@@ -37,6 +63,104 @@ class NoSessionLeftError(FetchError, IndexError):
     """
 
 
+class FatalFetchError(FetchError):
+    """
+    FetchError which is not worth retrying.
+    """
+
+
+class ParseFetchError(FatalFetchError):
+    """
+    Parse function of ParseClient failed.
+    """
+
+
+class StatusFetchError(WebFetchError):
+    """
+    Unexpected HTTP status.
+
+    retry_after is taken from Retry-After header, in seconds.
+    """
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP status is {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+RETRYABLE_STATUSES = frozenset((
+    HTTPStatus.REQUEST_TIMEOUT,
+    HTTPStatus.TOO_MANY_REQUESTS,
+    HTTPStatus.INTERNAL_SERVER_ERROR,
+    HTTPStatus.BAD_GATEWAY,
+    HTTPStatus.SERVICE_UNAVAILABLE,
+    HTTPStatus.GATEWAY_TIMEOUT,
+))
+
+
+def is_retryable(error: FetchError) -> bool:
+    """
+    FatalFetchError and client side HTTP statuses are not retryable.
+    :param error:
+    :return:
+    """
+    if isinstance(error, FatalFetchError):
+        return False
+    if isinstance(error, StatusFetchError):
+        return error.status in RETRYABLE_STATUSES
+    return True
+
+
+def retry_after(response: ClientResponse) -> Optional[float]:
+    """
+    Parses Retry-After header, seconds or HTTP date.
+    :param response:
+    :return:
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def check_content_type(response: ClientResponse,
+                       prefix: Optional[str]) -> None:
+    """
+    Raises WebFetchError if content-type does not start with prefix.
+    :param response:
+    :param prefix:
+    :return:
+    """
+    if prefix is None:
+        return
+    content_type = response.headers.get('content-type')
+    if content_type \
+            and isinstance(content_type, str) \
+            and content_type.startswith(prefix):
+        return
+    raise WebFetchError(f"Invalid content type {content_type}")
+
+
+def check_status(response: ClientResponse) -> None:
+    """
+    Raises StatusFetchError if status is not 2xx.
+    :param response:
+    :return:
+    """
+    if not 200 <= response.status < 300:
+        raise StatusFetchError(response.status, retry_after(response))
+
+
 class Client(ABC, Generic[KT, VT]):
     """
     Client
@@ -50,6 +174,29 @@ class Client(ABC, Generic[KT, VT]):
         :return:
         """
 
+    async def fetch_many(self, keys: Iterable[KT], concurrency: int = 10) \
+            -> Dict[KT, Union[VT, FetchError]]:
+        """
+        Fetches keys, at most `concurrency` at once.
+
+        Failed keys are mapped to their FetchError.
+        :param keys:
+        :param concurrency:
+        :return:
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_one(key: KT) -> Union[VT, FetchError]:
+            async with semaphore:
+                try:
+                    return await self.fetch(key)
+                except FetchError as error:
+                    return error
+
+        keys = list(dict.fromkeys(keys))
+        values = await asyncio.gather(*[fetch_one(key) for key in keys])
+        return dict(zip(keys, values))
+
 
 class CrawlerClient(Client, ABC, Generic[KT, VT]):
     """
@@ -68,11 +215,24 @@ class CrawlerClient(Client, ABC, Generic[KT, VT]):
 class CacheClient(Client[str, VT]):
     """
     CacheClient
+
+    Concurrent fetches of a missing key share one underlying fetch.
+    Hits, misses and cache latency are recorded in `metrics`.
     """
 
-    def __init__(self, client: Client[str, VT], cache: Cache[str, VT]):
+    def __init__(self, client: Client[str, VT],
+                 cache: Union[Cache[str, VT], AsyncCache[str, VT]],
+                 metrics: Optional[Registry] = None):
         self._client = client
-        self._cache = cache
+        self._cache = to_async(cache)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        metrics = registry_or_null(metrics)
+        self._lookups = metrics.counter(
+            'aioscrapy_cache_lookups_total', "Cache lookups by result",
+            ('result',))
+        self._latency = metrics.histogram(
+            'aioscrapy_cache_seconds', "Cache get and set latency",
+            ('operation',))
 
     async def fetch(self, key: str) -> VT:
         """
@@ -80,26 +240,146 @@ class CacheClient(Client[str, VT]):
         :param key:
         :return:
         """
+        started = time.perf_counter()
         try:
-            value = self._cache.get(key)
+            value = await self._cache.get(key)
         except LookupError:
-            value = await self._client.fetch(key)
+            self._latency.observe(time.perf_counter() - started, 'get')
+            self._lookups.inc('miss')
+            return await self._fetch_once(key)
+        self._latency.observe(time.perf_counter() - started, 'get')
+        self._lookups.inc('hit')
+        return value
+
+    async def fetch_many(self, keys: Iterable[str], concurrency: int = 10) \
+            -> Dict[str, Union[VT, FetchError]]:
+        """
+        Looks up all keys with one get_many() call,
+        fetches only misses and stores them with one set_many() call.
+        Misses already being fetched are joined.
+        :param keys:
+        :param concurrency:
+        :return:
+        """
+        keys = list(dict.fromkeys(keys))
+        started = time.perf_counter()
+        results: Dict[str, Union[VT, FetchError]] = dict(
+            await self._cache.get_many(keys))
+        self._latency.observe(time.perf_counter() - started, 'get')
+        misses = [key for key in keys if key not in results]
+        if results:
+            self._lookups.inc('hit', amount=len(results))
+        if misses:
+            self._lookups.inc('miss', amount=len(misses))
+        joined = {
+            key: self._in_flight[key]
+            for key in misses if key in self._in_flight
+        }
+        loop = asyncio.get_running_loop()
+        owned = {
+            key: loop.create_future()
+            for key in misses if key not in joined
+        }
+        # concurrent fetch() of these keys joins the batch
+        self._in_flight.update(owned)
+        try:
+            fetched = await self._client.fetch_many(list(owned), concurrency)
+            values = {
+                key: value for key, value in fetched.items()
+                if not isinstance(value, FetchError)
+            }
+            results.update(fetched)
+            if values:
+                started = time.perf_counter()
+                try:
+                    await self._cache.set_many(values)
+                except OSError:
+                    for key in values:
+                        results[key] = OSFetchError(
+                            f"Cannot set key '{key}' to cache")
+                finally:
+                    self._latency.observe(
+                        time.perf_counter() - started, 'set')
+        finally:
+            for key, future in owned.items():
+                self._forget(key, future)
+                self._resolve(future, results.get(key), key in results)
+        for key, task in joined.items():
+            try:
+                results[key] = await asyncio.shield(task)
+            except FetchError as error:
+                results[key] = error
+        return {key: results[key] for key in keys}
+
+    async def _fetch_once(self, key: str) -> VT:
+        """
+        Joins in-flight fetch of key or starts a new one.
+        :param key:
+        :return:
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key))
+            self._in_flight[key] = task
+            task.add_done_callback(
+                lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: str) -> VT:
+        """
 
+        :param key:
+        :return:
+        """
+        value = await self._client.fetch(key)
+        started = time.perf_counter()
         try:
-            self._cache.set(key, value)
+            await self._cache.set(key, value)
         except OSError:
             raise OSFetchError(f"Cannot set key '{key}' to cache")
+        finally:
+            self._latency.observe(time.perf_counter() - started, 'set')
         return value
 
+    @staticmethod
+    def _resolve(future: asyncio.Future, value: Any, found: bool) -> None:
+        """
+        Passes result of a batch fetch to joined fetches,
+        the future is cancelled if the batch failed.
+        :param future:
+        :param value:
+        :param found:
+        :return:
+        """
+        if not found:
+            future.cancel()
+        elif isinstance(value, FetchError):
+            future.set_exception(value)
+            # nobody may be waiting, do not log it as never retrieved
+            future.exception()
+        else:
+            future.set_result(value)
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        """
+
+        :param key:
+        :param task:
+        :return:
+        """
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
 
 class CacheOnlyClient(Client[str, VT]):
     """
     CacheOnlyClient
     """
 
-    def __init__(self, client: Client[str, VT], cache: Cache[str, VT]):
+    def __init__(self, client: Client[str, VT],
+                 cache: Union[Cache[str, VT], AsyncCache[str, VT]]):
         self._client = client
-        self._cache = cache
+        self._cache = to_async(cache)
 
     async def fetch(self, key: str) -> VT:
         """
@@ -108,7 +388,7 @@ class CacheOnlyClient(Client[str, VT]):
         :return:
         """
         try:
-            return self._cache.get(key)
+            return await self._cache.get(key)
         except LookupError:
             raise FetchError(f"Key '{key}' does not exist")
 
@@ -118,9 +398,10 @@ class CacheSkipClient(Client[str, VT]):
     CacheSkipClient
     """
 
-    def __init__(self, client: Client[str, VT], cache: Cache[str, VT]):
+    def __init__(self, client: Client[str, VT],
+                 cache: Union[Cache[str, VT], AsyncCache[str, VT]]):
         self._client = client
-        self._cache = cache
+        self._cache = to_async(cache)
 
     async def fetch(self, key: str) -> VT:
         """
@@ -129,14 +410,14 @@ class CacheSkipClient(Client[str, VT]):
         :return:
         """
         try:
-            self._cache.get(key)
+            await self._cache.get(key)
             raise FetchError(f"Key {key} exists")
         except LookupError:
             pass
 
         value = await self._client.fetch(key)
         try:
-            self._cache.set(key, value)
+            await self._cache.set(key, value)
         except OSError:
             raise OSFetchError(f"Cannot set key '{key}' to cache")
 
@@ -146,10 +427,14 @@ class CacheSkipClient(Client[str, VT]):
 class WebClient(Client[str, ClientResponse]):
     """
     WebClient
+
+    With raise_for_status non 2xx responses raise StatusFetchError.
     """
 
-    def __init__(self, session_pool: SessionPool):
+    def __init__(self, session_pool: SessionPool,
+                 raise_for_status: bool = False):
         self._session_pool = session_pool
+        self._raise_for_status = raise_for_status
 
     async def fetch(self, key: str) -> ClientResponse:
         """
@@ -157,21 +442,91 @@ class WebClient(Client[str, ClientResponse]):
         :param key:
         :return:
         """
+        response = await self.request(key)
+        try:
+            await response.read()
+        except ClientError:
+            raise WebFetchError()
+        return response
+
+    async def request(self, key: str,
+                      headers: Optional[Dict[str, str]] = None) \
+            -> ClientResponse:
+        """
+        Returns response with unread body, caller must release it.
+        :param key:
+        :param headers:
+        :return:
+        """
         try:
             proxy, session = self._session_pool.rand()
         except IndexError:
             raise NoSessionLeftError()
 
+        started = time.monotonic()
         try:
-            response: ClientResponse = await session.get(key, proxy=proxy)
-            await response.read()
-            return response
+            response: ClientResponse = await session.get(
+                key, proxy=proxy, headers=headers)
         except (ClientHttpProxyError, ClientProxyConnectionError):
             if proxy is not None:
+                self._session_pool.report(proxy, False)
                 self._session_pool.pop(proxy)
             raise WebFetchError()
         except ClientError:
+            self._session_pool.report(proxy, False)
             raise WebFetchError()
+        self._session_pool.report(proxy, True, time.monotonic() - started)
+        if self._raise_for_status:
+            try:
+                check_status(response)
+            except StatusFetchError:
+                response.release()
+                raise
+        return response
+
+
+async def stream_body(response: ClientResponse,
+                      write: Callable[[bytes], Awaitable[Any]],
+                      max_bytes: Optional[int] = None,
+                      chunk_size: int = 64 * 1024) -> int:
+    """
+    Passes body to `write` chunk by chunk, returns body size.
+
+    Raises WebFetchError if body is larger than max_bytes,
+    Content-Length is checked before reading.
+    """
+    if max_bytes is not None \
+            and response.content_length is not None \
+            and response.content_length > max_bytes:
+        raise WebFetchError(
+            f"Content-Length {response.content_length} exceeds {max_bytes}")
+    size = 0
+    try:
+        async for chunk in response.content.iter_chunked(chunk_size):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                raise WebFetchError(f"Body exceeds {max_bytes} bytes")
+            await write(chunk)
+    except ClientError:
+        raise WebFetchError()
+    return size
+
+
+async def read_body(response: ClientResponse,
+                    max_bytes: Optional[int] = None) -> bytes:
+    """
+    Reads body, at most max_bytes.
+    :param response:
+    :param max_bytes:
+    :return:
+    """
+    buffer = bytearray()
+
+    async def write(chunk: bytes) -> None:
+        buffer.extend(chunk)
+
+    await stream_body(response, write, max_bytes)
+    return bytes(buffer)
 
 
 class WebTextClient(Client[str, str]):
@@ -196,10 +551,14 @@ class WebTextClient(Client[str, str]):
 class WebByteClient(Client[str, bytes]):
     """
     WebByteClient
+
+    Bodies larger than max_bytes raise WebFetchError.
     """
 
-    def __init__(self, session_pool: SessionPool):
+    def __init__(self, session_pool: SessionPool,
+                 max_bytes: Optional[int] = None):
         self._session_pool = session_pool
+        self._max_bytes = max_bytes
 
     async def fetch(self, key: str) -> bytes:
         """
@@ -208,21 +567,224 @@ class WebByteClient(Client[str, bytes]):
         :return:
         """
         client = WebClient(self._session_pool)
-        response = await client.fetch(key)
-        # noinspection PyProtectedMember
-        return response._body  # pylint: disable=W0212
+        response = await client.request(key)
+        try:
+            return await read_body(response, self._max_bytes)
+        finally:
+            response.release()
+
+
+_DOWNLOAD_IDS = itertools.count()
+
+
+class DownloadClient(Client[str, str]):
+    """
+    Streams body into file and returns its path
+    BASE_FOLDER/ab/abcdef1234567890abcdef1234567890
+    where abcdef1234567890abcdef1234567890 is md5(key)
+
+    Status and content type (if `content_type` prefix is set)
+    are checked before the body is read.
+    """
+
+    def __init__(self, session_pool: SessionPool, folder: str,
+                 max_bytes: Optional[int] = None,
+                 content_type: Optional[str] = None,
+                 chunk_size: int = 64 * 1024):
+        self._session_pool = session_pool
+        self._folder = folder
+        self._max_bytes = max_bytes
+        self._content_type = content_type
+        self._chunk_size = chunk_size
+
+    async def fetch(self, key: str) -> str:
+        """
+
+        :param key:
+        :return:
+        """
+        client = WebClient(self._session_pool)
+        response = await client.request(key)
+        try:
+            check_status(response)
+            check_content_type(response, self._content_type)
+            md5 = hashlib.md5(key.encode()).hexdigest()
+            path = os.path.join(self._folder, md5[:2], md5)
+            await self._download(response, path)
+            return path
+        finally:
+            response.release()
+
+    async def _download(self, response: ClientResponse, path: str) -> None:
+        """
+        Writes body to temporary file in thread pool and renames it.
+        :param response:
+        :param path:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        # concurrent fetches of one key must not share a temporary file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.' \
+            f'{next(_DOWNLOAD_IDS)}.tmp'
+        try:
+            await loop.run_in_executor(
+                None, functools.partial(
+                    os.makedirs, os.path.dirname(path), exist_ok=True))
+            file = await loop.run_in_executor(None, open, tmp_path, 'wb')
+        except OSError as error:
+            raise OSFetchError(f"Cannot open '{tmp_path}': {error!r}")
+
+        async def write(chunk: bytes) -> None:
+            await loop.run_in_executor(None, file.write, chunk)
+
+        try:
+            try:
+                await stream_body(
+                    response, write, self._max_bytes, self._chunk_size)
+            finally:
+                await loop.run_in_executor(None, file.close)
+            await loop.run_in_executor(None, os.replace, tmp_path, path)
+        except BaseException as error:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            if isinstance(error, OSError):
+                raise OSFetchError(
+                    f"Cannot write '{path}': {error!r}") from error
+            raise
+
+
+class CacheEntry(NamedTuple):
+    """
+    Value stored by RevalidatingClient with its validators.
+
+    expires is a unix timestamp.
+    """
+    value: Any
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    expires: float = 0.0
+
+
+class RevalidatingClient(Client[str, VT]):
+    """
+    Caches decoded responses with ETag and Last-Modified.
+
+    Fresh entries are returned from cache, stale ones are revalidated
+    with If-None-Match / If-Modified-Since and reused on 304.
+    Freshness is Cache-Control max-age or `max_age` seconds,
+    no-store responses are not cached.
+    `decode` turns response into value, body bytes by default.
+    """
+
+    def __init__(self, session_pool: SessionPool,
+                 cache: Union[Cache[str, CacheEntry],
+                              AsyncCache[str, CacheEntry]],
+                 decode: Optional[
+                     Callable[[ClientResponse], Awaitable[VT]]] = None,
+                 max_age: float = 0.0):
+        self._session_pool = session_pool
+        self._cache = to_async(cache)
+        self._decode = decode or read_body
+        self._max_age = max_age
+
+    async def fetch(self, key: str) -> VT:
+        """
+
+        :param key:
+        :return:
+        """
+        entry: Optional[CacheEntry]
+        try:
+            entry = await self._cache.get(key)
+        except LookupError:
+            entry = None
+        if entry is not None and entry.expires > time.time():
+            return entry.value
+
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+        client = WebClient(self._session_pool)
+        response = await client.request(key, headers)
+        try:
+            cache_control = self._cache_control(response)
+            expires = time.time() + float(cache_control.get(
+                'max-age', self._max_age))
+            if entry is not None \
+                    and response.status == HTTPStatus.NOT_MODIFIED:
+                value = entry.value
+                entry = entry._replace(
+                    etag=response.headers.get('ETag', entry.etag),
+                    expires=expires)
+            else:
+                check_status(response)
+                value = await self._decode(response)
+                entry = CacheEntry(
+                    value, response.headers.get('ETag'),
+                    response.headers.get('Last-Modified'), expires)
+        finally:
+            response.release()
+
+        if 'no-store' not in cache_control:
+            try:
+                await self._cache.set(key, entry)
+            except OSError:
+                raise OSFetchError(f"Cannot set key '{key}' to cache")
+        return value
+
+    @staticmethod
+    def _cache_control(response: ClientResponse) -> Dict[str, str]:
+        """
+        Parses Cache-Control header, no-cache means max-age=0.
+        :param response:
+        :return:
+        """
+        directives: Dict[str, str] = {}
+        for part in response.headers.get('Cache-Control', '').split(','):
+            name, _, value = part.strip().partition('=')
+            if name:
+                directives[name.lower()] = value.strip('"')
+        if 'no-cache' in directives:
+            directives['max-age'] = '0'
+        try:
+            float(directives.get('max-age', 0))
+        except ValueError:
+            del directives['max-age']
+        return directives
 
 
 class RetryClient(Client[KT, VT]):
     """
     RetryClient
+
+    Waits random time up to backoff * 2 ** attempt, at most max_backoff,
+    before retry. Retry-After longer than max_retry_after is not waited.
+    Errors rejected by `retryable` are raised at once.
+    With `budget` retries are limited to a share of all requests.
+    Retries are counted in `metrics` by error class.
     """
 
-    def __init__(self, client: Client[KT, VT], retry_count: int):
+    def __init__(self, client: Client[KT, VT], retry_count: int,
+                 backoff: float = 0.1, max_backoff: float = 10.0,
+                 max_retry_after: float = 60.0,
+                 retryable: Callable[[FetchError], bool] = is_retryable,
+                 budget: Optional[RetryBudget] = None,
+                 metrics: Optional[Registry] = None):
         if retry_count <= 0:
             raise ValueError("retry_count must be greater than zero")
         self._retry_count = retry_count
         self._client = client
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._max_retry_after = max_retry_after
+        self._retryable = retryable
+        self._budget = budget
+        self._retries = registry_or_null(metrics).counter(
+            'aioscrapy_retries_total', "Retried fetches by error",
+            ('error',))
 
     async def fetch(self, key: KT) -> VT:
         """
@@ -230,21 +792,39 @@ class RetryClient(Client[KT, VT]):
         :param key:
         :return:
         """
-        for _ in range(self._retry_count - 1):
+        if self._budget is not None:
+            self._budget.deposit()
+        for attempt in range(self._retry_count - 1):
             try:
                 return await self._client.fetch(key)
-            except FetchError:
-                pass
+            except FetchError as error:
+                delay = random.uniform(0, min(
+                    self._backoff * 2 ** attempt, self._max_backoff))
+                wait = getattr(error, 'retry_after', None)
+                if wait is not None:
+                    if wait > self._max_retry_after:
+                        raise
+                    delay = max(delay, wait)
+                if not self._retryable(error) or (
+                        self._budget is not None
+                        and not self._budget.withdraw()):
+                    raise
+                self._retries.inc(type(error).__name__)
+            await asyncio.sleep(delay)
         return await self._client.fetch(key)
 
 
 class ImageClient(Client[str, bytes]):
     """
     ImageClient
+
+    Non-images are rejected before the body is read.
     """
 
-    def __init__(self, session_pool: SessionPool):
+    def __init__(self, session_pool: SessionPool,
+                 max_bytes: Optional[int] = None):
         self._session_pool = session_pool
+        self._max_bytes = max_bytes
 
     async def fetch(self, key: str) -> bytes:
         """
@@ -253,19 +833,218 @@ class ImageClient(Client[str, bytes]):
         :return:
         """
         client = WebClient(self._session_pool)
-        response = await client.fetch(key)
-        if response.status != HTTPStatus.OK:
-            raise WebFetchError("HTTP status is not 200")
+        response = await client.request(key)
+        try:
+            if response.status != HTTPStatus.OK:
+                raise StatusFetchError(
+                    response.status, retry_after(response))
+            check_content_type(response, 'image')
+            return await read_body(response, self._max_bytes)
+        finally:
+            response.release()
+
+
+class RateLimitClient(Client[str, VT]):
+    """
+    Limits concurrency and request rate per host.
+
+    Requests waiting for a busy host do not delay other hosts.
+    """
 
-        content_type = response.headers.get('content-type')
+    def __init__(self, client: Client[str, VT],
+                 limits: Optional[Dict[str, HostLimit]] = None,
+                 default: HostLimit = HostLimit(),
+                 host: Callable[[str], str] = url_host):
+        self._client = client
+        self._limiter = HostLimiter(limits, default)
+        self._host = host
 
-        if content_type \
-                and isinstance(content_type, str) \
-                and content_type.startswith('image'):
-            # noinspection PyProtectedMember
-            return response._body  # pylint: disable=W0212
+    async def fetch(self, key: str) -> VT:
+        """
 
-        raise WebFetchError(f"Invalid content type {content_type}")
+        :param key:
+        :return:
+        """
+        host = self._host(key)
+        await self._limiter.acquire(host)
+        try:
+            return await self._client.fetch(key)
+        finally:
+            self._limiter.release(host)
+
+
+class AdaptiveClient(Client[str, VT]):
+    """
+    Adapts concurrency to latency and FetchError rate.
+
+    `limiter` limits all requests,
+    with `host_limiter` set a limiter is created per host
+    from these AdaptiveLimiter arguments. Idle host limiters
+    are forgotten when the number of hosts doubles.
+    """
+
+    PRUNE_SIZE = 1024
+
+    def __init__(self, client: Client[str, VT],
+                 limiter: Optional[AdaptiveLimiter] = None,
+                 host_limiter: Optional[Dict[str, Any]] = None,
+                 host: Callable[[str], str] = url_host):
+        self._client = client
+        self.limiter = limiter or AdaptiveLimiter()
+        self._host_limiter = host_limiter
+        self._host_limiters: Dict[str, AdaptiveLimiter] = {}
+        self._prune_at = self.PRUNE_SIZE
+        self._host = host
+
+    def host_limits(self) -> Dict[str, int]:
+        """
+        Current limit of every host.
+        :return:
+        """
+        return {
+            host: limiter.limit
+            for host, limiter in self._host_limiters.items()
+        }
+
+    async def fetch(self, key: str) -> VT:
+        """
+
+        :param key:
+        :return:
+        """
+        limiters = [self.limiter]
+        if self._host_limiter is not None:
+            host = self._host(key)
+            if host not in self._host_limiters:
+                if len(self._host_limiters) >= self._prune_at:
+                    self._prune()
+                self._host_limiters[host] = \
+                    AdaptiveLimiter(**self._host_limiter)
+            limiters.insert(0, self._host_limiters[host])
+
+        started = []
+        ok: Optional[bool] = None
+        try:
+            for limiter in limiters:
+                started.append(await limiter.acquire())
+            value = await self._client.fetch(key)
+            ok = True
+            return value
+        except FetchError:
+            ok = False
+            raise
+        finally:
+            for limiter, start in zip(limiters, started):
+                limiter.release(start, ok)
+
+    def _prune(self) -> None:
+        """
+        Forgets idle host limiters, runs again when the table doubles.
+        :return:
+        """
+        self._host_limiters = {
+            host: limiter for host, limiter in self._host_limiters.items()
+            if not limiter.idle
+        }
+        self._prune_at = max(self.PRUNE_SIZE, 2 * len(self._host_limiters))
+
+
+class ParseClient(CrawlerClient[str, VT]):
+    """
+    Fetches raw body with `client` and runs CPU bound
+    `parse(key, body) -> (new_keys, value)` in a process pool,
+    so parsing does not block the event loop.
+
+    `parse` must be a picklable module level function,
+    new keys and value must be picklable too.
+    At most `max_pending` parse jobs are submitted to the pool at once,
+    twice the number of processes by default, fetches are not limited.
+    Exceptions raised by `parse` become ParseFetchError.
+    """
+
+    def __init__(self, client: Client[str, bytes],
+                 parse: Callable[[str, bytes], Tuple[Iterable[str], VT]],
+                 processes: Optional[int] = None,
+                 max_pending: Optional[int] = None,
+                 executor: Optional[Executor] = None):
+        self._client = client
+        self._parse = parse
+        self._max_pending = max_pending or 2 * (
+            processes or os.cpu_count() or 1)
+        self._own_executor = executor is None
+        self._executor = executor or ProcessPoolExecutor(processes)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def fetch(self, key: str) -> Tuple[Iterable[str], VT]:
+        """
+
+        :param key:
+        :return:
+        """
+        body = await self._client.fetch(key)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_pending)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                new_keys, value = await loop.run_in_executor(
+                    self._executor, self._parse, key, body)
+            except (BrokenExecutor, asyncio.CancelledError):
+                raise
+            except Exception as error:  # pylint: disable=broad-except
+                raise ParseFetchError(
+                    f"Cannot parse '{key}': {error!r}") from error
+            return new_keys, value
+
+    def close(self) -> None:
+        """
+        Shuts down own process pool.
+        :return:
+        """
+        if self._own_executor:
+            self._executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MetricsClient(Client[str, VT]):
+    """
+    Records fetch latency, requests in flight and errors per host.
+    """
+
+    def __init__(self, client: Client[str, VT], metrics: Registry,
+                 host: Callable[[str], str] = url_host):
+        self._client = client
+        self._host = host
+        self._latency = metrics.histogram(
+            'aioscrapy_fetch_seconds', "Fetch latency", ('host',))
+        self._in_flight = metrics.gauge(
+            'aioscrapy_fetches_in_flight', "Fetches in flight", ('host',))
+        self._errors = metrics.counter(
+            'aioscrapy_fetch_errors_total', "Failed fetches",
+            ('host', 'error'))
+
+    async def fetch(self, key: str) -> VT:
+        """
+
+        :param key:
+        :return:
+        """
+        host = self._host(key)
+        self._in_flight.inc(host)
+        started = time.perf_counter()
+        try:
+            return await self._client.fetch(key)
+        except FetchError as error:
+            self._errors.inc(host, type(error).__name__)
+            raise
+        finally:
+            self._latency.observe(time.perf_counter() - started, host)
+            self._in_flight.dec(host)
 
 
 class FakeClient(Client[str, str]):
@@ -0,0 +1,218 @@
+"""
+Memory compact sets of seen keys
+"""
+
+import hashlib
+import math
+from array import array
+from typing import List
+
+
+def fingerprint(key: str, size: int = 8) -> bytes:
+    """
+    Returns `size` bytes long hash of key.
+    :param key:
+    :param size:
+    :return:
+    """
+    return hashlib.blake2b(key.encode(), digest_size=size).digest()
+
+
+class FingerprintSet:
+    """
+    Set of 64 or 128 bit key fingerprints.
+
+    Fingerprints are kept in an open addressing hash table
+    backed by array('Q'), 16-32 bytes per key instead of a full string.
+    Two keys with the same fingerprint are considered equal.
+    """
+
+    def __init__(self, bits: int = 64, capacity: int = 1024):
+        if bits not in (64, 128):
+            raise ValueError("bits must be 64 or 128")
+        self._width = bits // 64
+        self._size = 0
+        self._slots = 1 << max(math.ceil(math.log2(capacity * 2)), 3)
+        self._table = array('Q', bytes(8 * self._width * self._slots))
+
+    def add(self, key: str) -> None:
+        """
+
+        :param key:
+        :return:
+        """
+        words = self._words(key)
+        if self._find(self._table, self._slots, words) < 0:
+            if (self._size + 1) * 2 > self._slots:
+                self._grow()
+            self._insert(self._table, self._slots, words)
+            self._size += 1
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        return self._find(self._table, self._slots, self._words(key)) >= 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _words(self, key: str) -> List[int]:
+        """
+        Fingerprint as list of non-zero 64 bit words, zero marks empty slot.
+        :param key:
+        :return:
+        """
+        digest = fingerprint(key, 8 * self._width)
+        return [
+            int.from_bytes(digest[i:i + 8], 'little') or 1
+            for i in range(0, len(digest), 8)
+        ]
+
+    def _find(self, table: array, slots: int, words: List[int]) -> int:
+        """
+        Returns position of fingerprint, or -1 - position of empty slot.
+        :param table:
+        :param slots:
+        :param words:
+        :return:
+        """
+        width = self._width
+        pos = words[0] & (slots - 1)
+        while True:
+            offset = pos * width
+            if table[offset] == 0:
+                return -1 - pos
+            if table[offset:offset + width].tolist() == words:
+                return pos
+            pos = (pos + 1) & (slots - 1)
+
+    def _insert(self, table: array, slots: int, words: List[int]) -> None:
+        """
+
+        :param table:
+        :param slots:
+        :param words:
+        :return:
+        """
+        offset = (-1 - self._find(table, slots, words)) * self._width
+        table[offset:offset + self._width] = array('Q', words)
+
+    def _grow(self) -> None:
+        """
+        Doubles the table.
+        :return:
+        """
+        width = self._width
+        slots = self._slots * 2
+        table = array('Q', bytes(8 * width * slots))
+        for offset in range(0, len(self._table), width):
+            if self._table[offset]:
+                words = self._table[offset:offset + width].tolist()
+                self._insert(table, slots, words)
+        self._table, self._slots = table, slots
+
+
+class BloomFilter:
+    """
+    Scalable Bloom filter.
+
+    When a filter reaches its capacity a new one, twice as large and
+    with half the error rate, is appended, so the overall false
+    positive rate stays below `error_rate`.
+    A false positive makes a never seen key look seen.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self._size = 0
+        self._filters: List[_BloomSlice] = [
+            _BloomSlice(capacity, error_rate / 2)
+        ]
+
+    def add(self, key: str) -> None:
+        """
+
+        :param key:
+        :return:
+        """
+        hashes = self._hashes(key)
+        if any(bloom.contains(hashes) for bloom in self._filters):
+            return
+        last = self._filters[-1]
+        if last.count >= last.capacity:
+            last = _BloomSlice(last.capacity * 2, last.error_rate / 2)
+            self._filters.append(last)
+        last.add(hashes)
+        self._size += 1
+
+    def __contains__(self, key: object) -> bool:
+        if not isinstance(key, str):
+            return False
+        hashes = self._hashes(key)
+        return any(bloom.contains(hashes) for bloom in self._filters)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _hashes(key: str) -> List[int]:
+        """
+
+        :param key:
+        :return:
+        """
+        digest = fingerprint(key, 16)
+        return [
+            int.from_bytes(digest[:8], 'little'),
+            int.from_bytes(digest[8:], 'little') | 1,
+        ]
+
+
+class _BloomSlice:
+    """
+    Fixed size Bloom filter.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = 0
+        self._bits = max(
+            int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self._hash_count = max(
+            int(round(self._bits / capacity * math.log(2))), 1)
+        self._array = bytearray((self._bits + 7) // 8)
+
+    def add(self, hashes: List[int]) -> None:
+        """
+
+        :param hashes:
+        :return:
+        """
+        for bit in self._positions(hashes):
+            self._array[bit >> 3] |= 1 << (bit & 7)
+        self.count += 1
+
+    def contains(self, hashes: List[int]) -> bool:
+        """
+
+        :param hashes:
+        :return:
+        """
+        return all(
+            self._array[bit >> 3] & (1 << (bit & 7))
+            for bit in self._positions(hashes)
+        )
+
+    def _positions(self, hashes: List[int]) -> List[int]:
+        """
+        Double hashing: h1 + i * h2.
+        :param hashes:
+        :return:
+        """
+        first, second = hashes
+        return [
+            (first + i * second) % self._bits
+            for i in range(self._hash_count)
+        ]
@@ -0,0 +1,297 @@
+"""
+Concurrency and rate limits
+"""
+
+import asyncio
+import time
+from collections import deque
+from fnmatch import fnmatch
+from typing import NamedTuple, Optional, Dict, Deque
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second with bursts up to `burst`.
+
+    Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate must be greater than zero")
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        """
+        Waits for a token.
+        :return:
+        """
+        now = time.monotonic()
+        self._tokens = min(
+            self._tokens + (now - self._updated) * self._rate, self._burst)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            try:
+                await asyncio.sleep(-self._tokens / self._rate)
+            except asyncio.CancelledError:
+                self._tokens += 1
+                raise
+
+    def full(self) -> bool:
+        """
+        True if a burst is available, so the bucket may be dropped.
+        :return:
+        """
+        elapsed = time.monotonic() - self._updated
+        return self._tokens + elapsed * self._rate >= self._burst
+
+
+class HostLimit(NamedTuple):
+    """
+    Limits for one host.
+
+    concurrency - max requests in flight, rate - max requests per second.
+    None means unlimited.
+    """
+    concurrency: Optional[int] = None
+    rate: Optional[float] = None
+    burst: int = 1
+
+
+class HostLimiter:
+    """
+    Keeps semaphore and token bucket for every host.
+
+    `limits` maps fnmatch patterns like '*.example.com' to HostLimit,
+    the first matching pattern wins, `default` is used otherwise.
+    Hosts without requests in flight and with a full bucket
+    are forgotten when the number of hosts doubles.
+    """
+
+    PRUNE_SIZE = 1024
+
+    def __init__(self, limits: Optional[Dict[str, HostLimit]] = None,
+                 default: HostLimit = HostLimit()):
+        self._limits = limits or {}
+        self._default = default
+        self._semaphores: Dict[str, Optional[asyncio.Semaphore]] = {}
+        self._buckets: Dict[str, Optional[TokenBucket]] = {}
+        self._in_flight: Dict[str, int] = {}
+        self._prune_at = self.PRUNE_SIZE
+
+    def limit(self, host: str) -> HostLimit:
+        """
+        Returns HostLimit for host.
+        :param host:
+        :return:
+        """
+        for pattern, limit in self._limits.items():
+            if fnmatch(host, pattern):
+                return limit
+        return self._default
+
+    async def acquire(self, host: str) -> None:
+        """
+        Waits for a free slot and a token of host.
+        :param host:
+        :return:
+        """
+        if host not in self._semaphores:
+            if len(self._semaphores) >= self._prune_at:
+                self._prune()
+            limit = self.limit(host)
+            self._semaphores[host] = None if limit.concurrency is None \
+                else asyncio.Semaphore(limit.concurrency)
+            self._buckets[host] = None if limit.rate is None \
+                else TokenBucket(limit.rate, limit.burst)
+        self._in_flight[host] = self._in_flight.get(host, 0) + 1
+        semaphore = self._semaphores[host]
+        if semaphore is not None:
+            try:
+                await semaphore.acquire()
+            except asyncio.CancelledError:
+                self._finish(host)
+                raise
+        bucket = self._buckets[host]
+        if bucket is not None:
+            try:
+                await bucket.acquire()
+            except asyncio.CancelledError:
+                self.release(host)
+                raise
+
+    def release(self, host: str) -> None:
+        """
+        Frees slot of host.
+        :param host:
+        :return:
+        """
+        semaphore = self._semaphores.get(host)
+        if semaphore is not None:
+            semaphore.release()
+        self._finish(host)
+
+    def _finish(self, host: str) -> None:
+        """
+        Counts end of a request of host.
+        :param host:
+        :return:
+        """
+        count = self._in_flight.get(host, 0) - 1
+        if count > 0:
+            self._in_flight[host] = count
+        else:
+            self._in_flight.pop(host, None)
+
+    def _prune(self) -> None:
+        """
+        Forgets idle hosts, runs again when the table doubles.
+        :return:
+        """
+        for host, bucket in list(self._buckets.items()):
+            if host not in self._in_flight \
+                    and (bucket is None or bucket.full()):
+                del self._semaphores[host]
+                del self._buckets[host]
+        self._prune_at = max(self.PRUNE_SIZE, 2 * len(self._semaphores))
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit.
+
+    The limit grows by `increase` per `limit` successful requests
+    and is multiplied by `decrease` on failure or when latency exceeds
+    `latency_target`. Requests started before the last decrease
+    do not decrease it again, so one burst of errors counts once.
+    """
+
+    def __init__(self, initial: int = 10, minimum: int = 1,
+                 maximum: int = 1000, increase: float = 1.0,
+                 decrease: float = 0.5,
+                 latency_target: Optional[float] = None):
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self._limit = float(initial)
+        self._minimum = minimum
+        self._maximum = maximum
+        self._increase = increase
+        self._decrease = decrease
+        self._latency_target = latency_target
+        self._in_flight = 0
+        self._decreased_at = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def limit(self) -> int:
+        """
+        Current concurrency limit.
+        :return:
+        """
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Number of acquired slots.
+        :return:
+        """
+        return self._in_flight
+
+    @property
+    def idle(self) -> bool:
+        """
+        True if no slots are acquired or awaited.
+        :return:
+        """
+        return not self._in_flight and not self._waiters
+
+    async def acquire(self) -> float:
+        """
+        Waits for a free slot, returns start time for release().
+        :return:
+        """
+        while self._in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif not waiter.cancelled():
+                    self._wakeup()
+                raise
+        self._in_flight += 1
+        return time.monotonic()
+
+    def release(self, started: float, ok: Optional[bool] = True) -> None:
+        """
+        Frees slot and adjusts limit, ok=None leaves limit unchanged.
+        :param started:
+        :param ok:
+        :return:
+        """
+        self._in_flight -= 1
+        now = time.monotonic()
+        if ok is not None:
+            slow = self._latency_target is not None \
+                and now - started > self._latency_target
+            if ok and not slow:
+                self._limit = min(
+                    self._limit + self._increase / self._limit,
+                    self._maximum)
+            elif started >= self._decreased_at:
+                self._limit = max(
+                    self._limit * self._decrease, self._minimum)
+                self._decreased_at = now
+        self._wakeup()
+
+    def _wakeup(self) -> None:
+        """
+        Wakes up waiters for free slots.
+        :return:
+        """
+        free = self.limit - self._in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class RetryBudget:
+    """
+    Allows retries up to `ratio` of requests.
+
+    Every request deposits `ratio` tokens, every retry takes one,
+    `minimum` tokens are available from the start.
+    Share one budget between clients to cap retries globally.
+    """
+
+    def __init__(self, ratio: float = 0.1, minimum: int = 10,
+                 maximum: int = 1000):
+        self._ratio = ratio
+        self._maximum = maximum
+        self._tokens = float(minimum)
+
+    def deposit(self) -> None:
+        """
+        Called on every request.
+        :return:
+        """
+        self._tokens = min(self._tokens + self._ratio, self._maximum)
+
+    def withdraw(self) -> bool:
+        """
+        Returns False if retry is not allowed.
+        :return:
+        """
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
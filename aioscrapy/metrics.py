@@ -0,0 +1,482 @@
+"""
+Counters, gauges and histograms of a running crawl
+"""
+
+import bisect
+import functools
+import math
+from typing import (
+    Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple)
+
+from aiohttp import web
+
+Labels = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class HistogramValue(NamedTuple):
+    """
+    Histogram state for one set of labels.
+
+    observed - number of observations, sum - their sum,
+    buckets - (upper bound, cumulative count) pairs, the last is +Inf.
+    """
+    observed: int
+    sum: float
+    buckets: Tuple[Tuple[float, int], ...]
+
+
+class Metric:
+    """
+    Metric with a fixed list of label names.
+
+    Label values are passed positionally in the order of `labels`.
+    Metrics are not thread safe, update them from the event loop thread.
+    """
+
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, help: str = '', labels: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def collect(self) -> Dict[Labels, Any]:
+        """
+        Current value for every set of label values.
+        :return:
+        """
+        return {}
+
+
+class Counter(Metric):
+    """
+    Value which only goes up.
+    """
+
+    TYPE = 'counter'
+
+    def __init__(self, name: str, help: str = '', labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """
+
+        :param labels:
+        :param amount:
+        :return:
+        """
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def collect(self) -> Dict[Labels, Any]:
+        """
+
+        :return:
+        """
+        return dict(self._values)
+
+
+class Gauge(Metric):
+    """
+    Value which goes up and down.
+
+    Values set by `track` are read from the callback on collect.
+    """
+
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, help: str = '', labels: Labels = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+        self._callbacks: Dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        """
+
+        :param value:
+        :param labels:
+        :return:
+        """
+        self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """
+
+        :param labels:
+        :param amount:
+        :return:
+        """
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        """
+
+        :param labels:
+        :param amount:
+        :return:
+        """
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def track(self, callback: Callable[[], float], *labels: str) -> None:
+        """
+        Reads value from callback every time the gauge is collected.
+        :param callback:
+        :param labels:
+        :return:
+        """
+        self._callbacks[labels] = callback
+
+    def collect(self) -> Dict[Labels, Any]:
+        """
+
+        :return:
+        """
+        values = dict(self._values)
+        for labels, callback in self._callbacks.items():
+            values[labels] = float(callback())
+        return values
+
+
+class Histogram(Metric):
+    """
+    Counts observed values in buckets.
+    """
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help: str = '', labels: Labels = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self._bounds = sorted(buckets)
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+
+        :param value:
+        :param labels:
+        :return:
+        """
+        counts = self._values.get(labels)
+        if counts is None:
+            # bucket counts, then +Inf count and sum
+            counts = self._values[labels] = [0] * (len(self._bounds) + 2)
+        counts[bisect.bisect_left(self._bounds, value)] += 1
+        counts[-1] += value
+
+    def collect(self) -> Dict[Labels, Any]:
+        """
+
+        :return:
+        """
+        result = {}
+        bounds = self._bounds + [math.inf]
+        for labels, counts in self._values.items():
+            buckets = []
+            total = 0
+            for bound, count in zip(bounds, counts):
+                total += int(count)
+                buckets.append((bound, total))
+            result[labels] = HistogramValue(total, counts[-1], tuple(buckets))
+        return result
+
+
+class Registry:
+    """
+    Keeps metrics of a crawl.
+
+    `snapshot` returns current values in process,
+    `prometheus` renders them in Prometheus text format.
+    Subclasses may override counter, gauge and histogram
+    to send values to another sink.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, help: str = '',
+                labels: Labels = ()) -> Counter:
+        """
+        Returns existing metric with this name or creates a new one.
+        :param name:
+        :param help:
+        :param labels:
+        :return:
+        """
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str = '', labels: Labels = ()) -> Gauge:
+        """
+
+        :param name:
+        :param help:
+        :param labels:
+        :return:
+        """
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str = '', labels: Labels = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        """
+
+        :param name:
+        :param help:
+        :param labels:
+        :param buckets:
+        :return:
+        """
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def snapshot(self) -> Dict[str, Dict[Labels, Any]]:
+        """
+        Maps metric name to values by label values.
+        :return:
+        """
+        return {
+            name: metric.collect() for name, metric in self._metrics.items()
+        }
+
+    def prometheus(self) -> str:
+        """
+        Renders all metrics in Prometheus text exposition format.
+        :return:
+        """
+        lines = []
+        for name, metric in self._metrics.items():
+            if metric.help:
+                lines.append(f'# HELP {name} {_escape(metric.help)}')
+            lines.append(f'# TYPE {name} {metric.TYPE}')
+            for values, value in metric.collect().items():
+                pairs = list(zip(metric.labels, values))
+                if not isinstance(value, HistogramValue):
+                    lines.append(_sample(name, pairs, value))
+                    continue
+                for bound, count in value.buckets:
+                    lines.append(_sample(
+                        name + '_bucket', pairs + [('le', _number(bound))],
+                        count))
+                lines.append(_sample(name + '_sum', pairs, value.sum))
+                lines.append(_sample(name + '_count', pairs, value.observed))
+        return '\n'.join(lines) + '\n'
+
+    def _get(self, cls: type, name: str, help: str, labels: Labels,
+             *args: Any) -> Any:
+        """
+
+        :param cls:
+        :param name:
+        :param help:
+        :param labels:
+        :param args:
+        :return:
+        """
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, help, labels, *args)
+        elif type(metric) is not cls or metric.labels != tuple(labels):
+            raise ValueError(f"Metric '{name}' is already registered "
+                             f"as {metric.TYPE} with labels {metric.labels}")
+        return metric
+
+
+class _NullCounter(Counter):
+    """
+    Ignores all updates.
+    """
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """
+
+        :param labels:
+        :param amount:
+        :return:
+        """
+
+
+class _NullGauge(Gauge):
+    """
+    Ignores all updates.
+    """
+
+    def set(self, value: float, *labels: str) -> None:
+        """
+
+        :param value:
+        :param labels:
+        :return:
+        """
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """
+
+        :param labels:
+        :param amount:
+        :return:
+        """
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        """
+
+        :param labels:
+        :param amount:
+        :return:
+        """
+
+    def track(self, callback: Callable[[], float], *labels: str) -> None:
+        """
+
+        :param callback:
+        :param labels:
+        :return:
+        """
+
+
+class _NullHistogram(Histogram):
+    """
+    Ignores all updates.
+    """
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+
+        :param value:
+        :param labels:
+        :return:
+        """
+
+
+class NullRegistry(Registry):
+    """
+    Registry which records nothing, used when metrics are off.
+    """
+
+    _COUNTER = _NullCounter('null')
+    _GAUGE = _NullGauge('null')
+    _HISTOGRAM = _NullHistogram('null')
+
+    def counter(self, name: str, help: str = '',
+                labels: Labels = ()) -> Counter:
+        """
+
+        :param name:
+        :param help:
+        :param labels:
+        :return:
+        """
+        return self._COUNTER
+
+    def gauge(self, name: str, help: str = '', labels: Labels = ()) -> Gauge:
+        """
+
+        :param name:
+        :param help:
+        :param labels:
+        :return:
+        """
+        return self._GAUGE
+
+    def histogram(self, name: str, help: str = '', labels: Labels = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        """
+
+        :param name:
+        :param help:
+        :param labels:
+        :param buckets:
+        :return:
+        """
+        return self._HISTOGRAM
+
+
+NULL_REGISTRY = NullRegistry()
+
+
+def registry_or_null(metrics: Optional[Registry]) -> Registry:
+    """
+
+    :param metrics:
+    :return:
+    """
+    return NULL_REGISTRY if metrics is None else metrics
+
+
+def track_dispatcher(metrics: Registry, dispatcher: Any,
+                     name: str = 'default') -> None:
+    """
+    Exposes Dispatcher.stats() as aioscrapy_dispatcher_keys gauge.
+    :param metrics:
+    :param dispatcher:
+    :param name:
+    :return:
+    """
+    gauge = metrics.gauge(
+        'aioscrapy_dispatcher_keys', "Keys in Dispatcher by state",
+        ('dispatcher', 'state'))
+    for state in ('all', 'new', 'taken', 'done'):
+        gauge.track(functools.partial(_stat, dispatcher, state), name, state)
+
+
+def metrics_handler(metrics: Registry) \
+        -> Callable[[web.Request], Any]:
+    """
+    aiohttp handler serving metrics to Prometheus.
+
+        app.router.add_get('/metrics', metrics_handler(registry))
+    :param metrics:
+    :return:
+    """
+    async def handler(request: web.Request) -> web.Response:
+        return web.Response(
+            text=metrics.prometheus(),
+            headers={'Content-Type': 'text/plain; version=0.0.4'})
+    return handler
+
+
+def _stat(dispatcher: Any, state: str) -> float:
+    """
+
+    :param dispatcher:
+    :param state:
+    :return:
+    """
+    return dispatcher.stats()[state]
+
+
+def _sample(name: str, pairs: List[Tuple[str, str]], value: float) -> str:
+    """
+
+    :param name:
+    :param pairs:
+    :param value:
+    :return:
+    """
+    if not pairs:
+        return f'{name} {_number(value)}'
+    labels = ','.join(f'{key}="{_escape(val)}"' for key, val in pairs)
+    return f'{name}{{{labels}}} {_number(value)}'
+
+
+def _number(value: float) -> str:
+    """
+
+    :param value:
+    :return:
+    """
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    """
+
+    :param value:
+    :return:
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
@@ -0,0 +1,223 @@
+"""
+Staged fetch, parse and store pipeline
+"""
+
+import asyncio
+import time
+from typing import (
+    Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple)
+
+from .client import Client, FetchError
+from .typedefs import KT, VT, Sink
+from .worker import Dispatcher, Worker
+
+
+class StageStats:
+    """
+    Work done by one pipeline stage.
+
+    busy - seconds spent in stage calls summed over all its tasks,
+    elapsed - seconds from pipeline start until the stage finished.
+    """
+
+    def __init__(self, tasks: int):
+        self.tasks = tasks
+        self.processed = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.elapsed = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Processed keys per second.
+        :return:
+        """
+        return self.processed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def utilization(self) -> float:
+        """
+        Share of time stage tasks were busy, close to 1 for a bottleneck.
+        :return:
+        """
+        total = self.elapsed * self.tasks
+        return self.busy / total if total else 0.0
+
+
+class Pipeline(Worker[KT, VT]):
+    """
+    Runs fetch, parse and store stages concurrently.
+
+    `fetchers` tasks fetch keys from `dispatcher` with `client`,
+    `parsers` tasks call `parse(key, fetched) -> (new_keys, value)`,
+    `storers` tasks pass values to the sink of feed().
+    Stages are connected by queues of `queue_size` items,
+    a full queue pauses the stage before it.
+
+    New keys are added after parse and a key is acked once stored,
+    so a JournalDispatcher resumes keys which were not stored.
+    FetchError raised by any stage skips the key and is counted
+    in `stats`, other exceptions stop the pipeline.
+    """
+
+    STAGES = ('fetch', 'parse', 'store')
+
+    def __init__(self, dispatcher: Dispatcher[KT], client: Client[KT, Any],
+                 parse: Callable[
+                     [KT, Any], Awaitable[Tuple[Iterable[KT], VT]]],
+                 fetchers: int = 10, parsers: int = 1, storers: int = 1,
+                 queue_size: int = 100):
+        self._dispatcher = dispatcher
+        self._client = client
+        self._parse = parse
+        self._tasks = dict(zip(self.STAGES, (fetchers, parsers, storers)))
+        self._queue_size = queue_size
+        self.stats: Dict[str, StageStats] = self._new_stats()
+
+    async def run(self) -> Dict[KT, VT]:
+        """
+
+        :return:
+        """
+        results: Dict[KT, VT] = {}
+
+        async def collect(key: KT, value: VT) -> None:
+            results[key] = value
+
+        await self.feed(collect)
+        return results
+
+    async def feed(self, sink: Sink[KT, VT]) -> None:
+        """
+        Stats of the run are kept in `stats`.
+        :param sink:
+        :return:
+        """
+        self.stats = self._new_stats()
+        started = time.perf_counter()
+        parse_queue: asyncio.Queue = asyncio.Queue(self._queue_size)
+        store_queue: asyncio.Queue = asyncio.Queue(self._queue_size)
+        stages: Dict[str, List[asyncio.Future]] = {
+            'fetch': [
+                asyncio.ensure_future(self._fetch_loop(parse_queue))
+                for _ in range(self._tasks['fetch'])
+            ],
+            'parse': [
+                asyncio.ensure_future(
+                    self._parse_loop(parse_queue, store_queue))
+                for _ in range(self._tasks['parse'])
+            ],
+            'store': [
+                asyncio.ensure_future(self._store_loop(store_queue, sink))
+                for _ in range(self._tasks['store'])
+            ],
+        }
+
+        async def drain(stage: str, queue: Optional[asyncio.Queue],
+                        count: int) -> None:
+            await asyncio.gather(*stages[stage])
+            self.stats[stage].elapsed = time.perf_counter() - started
+            if queue is not None:
+                for _ in range(count):
+                    await queue.put(None)
+
+        tasks: List[asyncio.Future] = [
+            task for stage_tasks in stages.values() for task in stage_tasks
+        ] + [
+            asyncio.ensure_future(drain(
+                'fetch', parse_queue, len(stages['parse']))),
+            asyncio.ensure_future(drain(
+                'parse', store_queue, len(stages['store']))),
+            asyncio.ensure_future(drain('store', None, 0)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_loop(self, parse_queue: asyncio.Queue) -> None:
+        """
+
+        :param parse_queue:
+        :return:
+        """
+        stats = self.stats['fetch']
+        while True:
+            try:
+                key = await self._dispatcher.next()
+            except IndexError:
+                break
+            started = time.perf_counter()
+            try:
+                fetched = await self._client.fetch(key)
+            except FetchError:
+                stats.errors += 1
+                self._dispatcher.ack(key)
+                continue
+            finally:
+                stats.busy += time.perf_counter() - started
+            stats.processed += 1
+            await parse_queue.put((key, fetched))
+
+    async def _parse_loop(self, parse_queue: asyncio.Queue,
+                          store_queue: asyncio.Queue) -> None:
+        """
+
+        :param parse_queue:
+        :param store_queue:
+        :return:
+        """
+        stats = self.stats['parse']
+        while True:
+            item = await parse_queue.get()
+            if item is None:
+                break
+            key, fetched = item
+            started = time.perf_counter()
+            try:
+                new_keys, value = await self._parse(key, fetched)
+            except FetchError:
+                stats.errors += 1
+                self._dispatcher.ack(key)
+                continue
+            finally:
+                stats.busy += time.perf_counter() - started
+            stats.processed += 1
+            for new_key in new_keys:
+                self._dispatcher.add(new_key)
+            await store_queue.put((key, value))
+
+    async def _store_loop(self, store_queue: asyncio.Queue,
+                          sink: Sink[KT, VT]) -> None:
+        """
+
+        :param store_queue:
+        :param sink:
+        :return:
+        """
+        stats = self.stats['store']
+        while True:
+            item = await store_queue.get()
+            if item is None:
+                break
+            key, value = item
+            started = time.perf_counter()
+            try:
+                await sink(key, value)
+                stats.processed += 1
+            except FetchError:
+                stats.errors += 1
+            finally:
+                stats.busy += time.perf_counter() - started
+            self._dispatcher.ack(key)
+
+    def _new_stats(self) -> Dict[str, StageStats]:
+        """
+
+        :return:
+        """
+        return {
+            stage: StageStats(tasks) for stage, tasks in self._tasks.items()
+        }
@@ -0,0 +1,207 @@
+"""
+Value serialization for caches
+"""
+
+import abc
+import json
+import pickle
+import zlib
+from typing import Any, Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class DecodeError(ValueError):
+    """
+    Data cannot be decoded, it is corrupted
+    or was written by another serializer.
+    """
+
+
+class Serializer(abc.ABC):
+    """
+    Serializer interface
+    """
+
+    @abc.abstractmethod
+    def dumps(self, val: Any) -> bytes:
+        """
+        Raises TypeError if value is not supported.
+        """
+
+    @abc.abstractmethod
+    def loads(self, data: Buffer) -> Any:
+        """
+        Accepts any bytes-like object.
+
+        Raises DecodeError
+        """
+
+
+class PickleSerializer(Serializer):
+    """
+    Any picklable value. Never load data from untrusted sources.
+    """
+
+    def dumps(self, val: Any) -> bytes:
+        """
+
+        :param val:
+        :return:
+        """
+        return pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: Buffer) -> Any:
+        """
+
+        :param data:
+        :return:
+        """
+        try:
+            return pickle.loads(data)
+        except Exception as error:  # pylint: disable=broad-except
+            # corrupted pickles raise almost any exception
+            raise DecodeError(f"Cannot unpickle: {error!r}") from error
+
+
+class JSONSerializer(Serializer):
+    """
+    JSON compatible values, safe for untrusted data.
+    """
+
+    def dumps(self, val: Any) -> bytes:
+        """
+
+        :param val:
+        :return:
+        """
+        return json.dumps(val, separators=(',', ':')).encode()
+
+    def loads(self, data: Buffer) -> Any:
+        """
+
+        :param data:
+        :return:
+        """
+        try:
+            return json.loads(bytes(data))
+        except ValueError as error:
+            raise DecodeError(f"Cannot decode JSON: {error!r}") from error
+
+
+class RawSerializer(Serializer):
+    """
+    Stores bytes and str as is with one tag byte,
+    other values are passed to `fallback`.
+    """
+
+    BYTES = b'b'
+    TEXT = b's'
+    OTHER = b'o'
+
+    def __init__(self, fallback: Optional[Serializer] = None):
+        self._fallback = fallback or JSONSerializer()
+
+    def dumps(self, val: Any) -> bytes:
+        """
+
+        :param val:
+        :return:
+        """
+        if isinstance(val, bytes):
+            return self.BYTES + val
+        if isinstance(val, str):
+            return self.TEXT + val.encode()
+        return self.OTHER + self._fallback.dumps(val)
+
+    def loads(self, data: Buffer) -> Any:
+        """
+
+        :param data:
+        :return:
+        """
+        with memoryview(data) as view:
+            tag, body = bytes(view[:1]), view[1:]
+            if tag == self.BYTES:
+                return bytes(body)
+            if tag == self.TEXT:
+                try:
+                    return str(body, 'utf-8')
+                except UnicodeDecodeError as error:
+                    raise DecodeError(f"Cannot decode text: {error!r}") \
+                        from error
+            if tag == self.OTHER:
+                return self._fallback.loads(body)
+        raise DecodeError(f"Unknown tag {tag!r}")
+
+
+class ZlibSerializer(Serializer):
+    """
+    Compresses output of `inner` serializer with zlib.
+    """
+
+    def __init__(self, inner: Optional[Serializer] = None, level: int = 6):
+        self._inner = inner or PickleSerializer()
+        self._level = level
+
+    def dumps(self, val: Any) -> bytes:
+        """
+
+        :param val:
+        :return:
+        """
+        return zlib.compress(self._inner.dumps(val), self._level)
+
+    def loads(self, data: Buffer) -> Any:
+        """
+
+        :param data:
+        :return:
+        """
+        try:
+            data = zlib.decompress(data)
+        except zlib.error as error:
+            raise DecodeError(f"Cannot decompress: {error!r}") from error
+        return self._inner.loads(data)
+
+
+class ZstdSerializer(Serializer):
+    """
+    Compresses output of `inner` serializer with zstd.
+
+    Requires zstandard package. Zstd contexts are not thread safe,
+    so a new one is made for every call.
+    """
+
+    def __init__(self, inner: Optional[Serializer] = None, level: int = 3):
+        if zstandard is None:
+            raise ImportError("ZstdSerializer requires zstandard package")
+        self._inner = inner or PickleSerializer()
+        self._level = level
+
+    def dumps(self, val: Any) -> bytes:
+        """
+
+        :param val:
+        :return:
+        """
+        compressor = zstandard.ZstdCompressor(level=self._level)
+        return compressor.compress(self._inner.dumps(val))
+
+    def loads(self, data: Buffer) -> Any:
+        """
+
+        :param data:
+        :return:
+        """
+        decompressor = zstandard.ZstdDecompressor()
+        try:
+            data = decompressor.decompress(data)
+        except zstandard.ZstdError as error:
+            raise DecodeError(f"Cannot decompress: {error!r}") from error
+        return self._inner.loads(data)
@@ -2,20 +2,74 @@
 aiohttp.ClientSession wrappers
 """
 
+import asyncio
+import heapq
 import random
+import time
 import abc
-from typing import Dict, Iterable
+from typing import Dict, Iterable, List, Tuple, Optional, Set
 import aiohttp
+from .metrics import Registry, registry_or_null
+from .tracing import RequestTimings
 from .typedefs import Proxy, Session
 
 
+class ProxyStats:
+    """
+    Health of proxy.
+
+    Success rate and latency are exponentially weighted moving averages.
+    """
+
+    def __init__(self):
+        self.success = 1.0
+        self.latency = 0.0
+        self.failures = 0
+
+    def score(self) -> float:
+        """
+        Higher is better.
+        :return:
+        """
+        return self.success / (1.0 + self.latency)
+
+    def update(self, alpha: float, ok: bool,
+               latency: Optional[float] = None) -> None:
+        """
+
+        :param alpha:
+        :param ok:
+        :param latency:
+        :return:
+        """
+        self.success += alpha * ((1.0 if ok else 0.0) - self.success)
+        if latency is not None:
+            self.latency += alpha * (latency - self.latency)
+        self.failures = 0 if ok else self.failures + 1
+
+
 class ProxyPool:
     """
     Proxy pool.
+
+    Picks the healthier of two random proxies.
+    A failing proxy is put on cooldown, which doubles with every
+    consecutive failure up to `max_cooldown` seconds.
     """
 
-    def __init__(self, proxies: Iterable[Proxy]):
-        self._proxies = set(proxies)
+    def __init__(self, proxies: Iterable[Proxy], cooldown: float = 60.0,
+                 max_cooldown: float = 3600.0, alpha: float = 0.2):
+        self._cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._alpha = alpha
+        self._proxies: List[Proxy] = []
+        self._positions: Dict[Proxy, int] = {}
+        self._stats: Dict[Proxy, ProxyStats] = {}
+        self._cooling: List[Tuple[float, Proxy]] = []
+        for proxy in proxies:
+            if proxy not in self._stats:
+                self._stats[proxy] = ProxyStats()
+                self._add(proxy)
 
     def rand(self) -> Proxy:
         """
@@ -24,10 +78,25 @@ class ProxyPool:
         Raises IndexError on empty pool.
         :return:
         """
-        try:
-            return random.sample(self._proxies, 1)[0]
-        except ValueError:
+        self._release_cooled()
+        if not self._proxies:
             raise IndexError("No proxies left")
+        first = random.choice(self._proxies)
+        second = random.choice(self._proxies)
+        if self._stats[second].score() > self._stats[first].score():
+            return second
+        return first
+
+    def acquire(self) -> Proxy:
+        """
+        Takes random Proxy out of pool until cooldown() is called.
+
+        Raises IndexError on empty pool.
+        :return:
+        """
+        proxy = self.rand()
+        self._remove(proxy)
+        return proxy
 
     def pop(self, proxy: str) -> None:
         """
@@ -35,8 +104,79 @@ class ProxyPool:
         :param proxy:
         :return:
         """
-        if proxy in self._proxies:
-            self._proxies.remove(proxy)
+        self._remove(proxy)
+        self._stats.pop(proxy, None)
+
+    def cooldown(self, proxy: Proxy) -> None:
+        """
+        Takes proxy out of pool for a while.
+        :param proxy:
+        :return:
+        """
+        stats = self._stats.get(proxy)
+        if stats is None:
+            return
+        self._remove(proxy)
+        delay = min(self._cooldown * 2 ** max(stats.failures - 1, 0),
+                    self._max_cooldown)
+        heapq.heappush(self._cooling, (time.monotonic() + delay, proxy))
+
+    def report(self, proxy: Proxy, ok: bool,
+               latency: Optional[float] = None) -> None:
+        """
+        Updates proxy health.
+        :param proxy:
+        :param ok:
+        :param latency:
+        :return:
+        """
+        stats = self._stats.get(proxy)
+        if stats is not None:
+            stats.update(self._alpha, ok, latency)
+
+    def stats(self, proxy: Proxy) -> ProxyStats:
+        """
+
+        Raises KeyError for unknown proxy.
+        :param proxy:
+        :return:
+        """
+        return self._stats[proxy]
+
+    def _add(self, proxy: Proxy) -> None:
+        """
+
+        :param proxy:
+        :return:
+        """
+        if proxy not in self._positions:
+            self._positions[proxy] = len(self._proxies)
+            self._proxies.append(proxy)
+
+    def _remove(self, proxy: Proxy) -> None:
+        """
+        Swaps proxy with the last one and removes it in O(1).
+        :param proxy:
+        :return:
+        """
+        position = self._positions.pop(proxy, None)
+        if position is None:
+            return
+        last = self._proxies.pop()
+        if last != proxy:
+            self._proxies[position] = last
+            self._positions[last] = position
+
+    def _release_cooled(self) -> None:
+        """
+        Returns proxies with expired cooldown to pool.
+        :return:
+        """
+        now = time.monotonic()
+        while self._cooling and self._cooling[0][0] <= now:
+            _, proxy = heapq.heappop(self._cooling)
+            if proxy in self._stats:
+                self._add(proxy)
 
 
 class SessionPool(abc.ABC):
@@ -60,31 +200,62 @@ class SessionPool(abc.ABC):
         Usually used in case of proxy ban.
         """
 
+    def report(self, key: Optional[Proxy], ok: bool,
+               latency: Optional[float] = None) -> None:
+        """
+        Reports result of request made through Proxy.
+        """
+
 
 class ProxySessionPool(SessionPool):
     """
     ProxySessionPool
+
+    Proxy of popped Session is put on cooldown and its place is taken
+    by another proxy, the pool refills when proxies return.
+    Popped sessions are closed in background.
+    With `connector` all sessions share one connection pool.
+    Popped sessions are counted in `metrics`.
+    With `timings` request phases are timed per proxy and host.
     """
 
     def __init__(self, proxy_pool: ProxyPool, size: int,
-                 session_kwargs: dict = None, cookies: dict = None):
+                 session_kwargs: dict = None, cookies: dict = None,
+                 connector: Optional[aiohttp.BaseConnector] = None,
+                 connector_owner: bool = True,
+                 metrics: Optional[Registry] = None,
+                 timings: Optional[RequestTimings] = None):
         self._size = size
         self._proxy_pool = proxy_pool
         self._session_kwargs = session_kwargs or {}
         self._cookies = cookies or {}
+        self._connector = connector
+        self._connector_owner = connector_owner
+        self._proxies: List[Proxy] = []
+        self._positions: Dict[Proxy, int] = {}
         self._session_pool: Dict[Proxy, aiohttp.ClientSession] = {}
+        self._closing: Set[asyncio.Future] = set()
+        self._timings = timings
+        self._evictions = registry_or_null(metrics).counter(
+            'aioscrapy_proxy_evictions_total', "Popped proxy sessions")
         for _ in range(self._size):
             self._add_session()
 
     def rand(self) -> Session:
         """
-
+        Returns the healthier of two random sessions.
         :return:
         """
-        try:
-            return random.choice(list(self._session_pool.items()))
-        except IndexError:
+        while len(self._proxies) < self._size:
+            if not self._add_session():
+                break
+        if not self._proxies:
             raise IndexError('No sessions left')
+        proxy = random.choice(self._proxies)
+        other = random.choice(self._proxies)
+        if self._score(other) > self._score(proxy):
+            proxy = other
+        return proxy, self._session_pool[proxy]
 
     def pop(self, key: Proxy) -> None:
         """
@@ -93,23 +264,65 @@ class ProxySessionPool(SessionPool):
         :return:
         """
         if key in self._session_pool:
-            self._session_pool.pop(key)
+            session = self._session_pool.pop(key)
+            position = self._positions.pop(key)
+            last = self._proxies.pop()
+            if last != key:
+                self._proxies[position] = last
+                self._positions[last] = position
+            closing = asyncio.ensure_future(session.close())
+            self._closing.add(closing)
+            closing.add_done_callback(self._closing.discard)
+            self._proxy_pool.cooldown(key)
+            self._evictions.inc()
             self._add_session()
 
-    def _add_session(self) -> None:
+    def report(self, key: Optional[Proxy], ok: bool,
+               latency: Optional[float] = None) -> None:
+        """
+
+        :param key:
+        :param ok:
+        :param latency:
+        :return:
+        """
+        if key is not None:
+            self._proxy_pool.report(key, ok, latency)
+
+    def _score(self, proxy: Proxy) -> float:
         """
 
+        :param proxy:
         :return:
         """
         try:
-            proxy = self._proxy_pool.rand()
-            session_kwargs = self._session_kwargs
-            if proxy in self._cookies:
-                session_kwargs["cookies"] = self._cookies[proxy]
-            self._session_pool[proxy] = aiohttp.ClientSession(**session_kwargs)
-            self._proxy_pool.pop(proxy)
+            return self._proxy_pool.stats(proxy).score()
+        except KeyError:
+            return 0.0
+
+    def _add_session(self) -> bool:
+        """
+        Returns False if there are no proxies left.
+        :return:
+        """
+        try:
+            proxy = self._proxy_pool.acquire()
         except IndexError:
-            pass
+            return False
+        session_kwargs = dict(self._session_kwargs)
+        if proxy in self._cookies:
+            session_kwargs["cookies"] = self._cookies[proxy]
+        if self._connector is not None:
+            session_kwargs["connector"] = self._connector
+            session_kwargs["connector_owner"] = False
+        if self._timings is not None:
+            session_kwargs["trace_configs"] = list(
+                session_kwargs.get("trace_configs", ())
+            ) + [self._timings.trace_config(proxy)]
+        self._session_pool[proxy] = aiohttp.ClientSession(**session_kwargs)
+        self._positions[proxy] = len(self._proxies)
+        self._proxies.append(proxy)
+        return True
 
     async def __aenter__(self):
         return self
@@ -117,16 +330,27 @@ class ProxySessionPool(SessionPool):
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         for session in self._session_pool.values():
             await session.close()
+        if self._closing:
+            await asyncio.gather(*self._closing)
+        if self._connector is not None and self._connector_owner:
+            await self._connector.close()
 
 
 class SingleSessionPool(SessionPool):
     """
     One Session without Proxy.
+
+    With `timings` request phases are timed per host.
     """
 
-    def __init__(self, session_kwargs: dict = None):
+    def __init__(self, session_kwargs: dict = None,
+                 timings: Optional[RequestTimings] = None):
         if session_kwargs is None:
             session_kwargs = {}
+        if timings is not None:
+            session_kwargs = dict(session_kwargs, trace_configs=list(
+                session_kwargs.get("trace_configs", ())
+            ) + [timings.trace_config()])
         self.session = (None, aiohttp.ClientSession(**session_kwargs))
 
     def rand(self) -> Session:
@@ -0,0 +1,169 @@
+"""
+Request timings collected with aiohttp tracing
+"""
+
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+
+from .typedefs import Proxy
+
+
+class PhaseStats:
+    """
+    Duration of one request phase.
+
+    `latency` is an exponentially weighted moving average,
+    `mean` and `max` cover all requests.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.latency = 0.0
+
+    @property
+    def mean(self) -> float:
+        """
+
+        :return:
+        """
+        return self.total / self.count if self.count else 0.0
+
+    def update(self, alpha: float, duration: float) -> None:
+        """
+
+        :param alpha:
+        :param duration:
+        :return:
+        """
+        self.latency = duration if not self.count else \
+            self.latency + alpha * (duration - self.latency)
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+
+class RequestTimings:
+    """
+    Collects phase durations of requests per proxy and per host.
+
+    Phases:
+    dns - host name resolution,
+    acquire - waiting for a free connection in the connector,
+    connect - opening connection, DNS and TLS handshake included,
+    request_sent - from request start until headers are sent,
+    first_byte - from request start until response headers arrive.
+
+    Pass it as `timings` to SingleSessionPool or ProxySessionPool.
+    """
+
+    def __init__(self, alpha: float = 0.2):
+        self._alpha = alpha
+        self.proxies: Dict[Proxy, Dict[str, PhaseStats]] = {}
+        self.hosts: Dict[str, Dict[str, PhaseStats]] = {}
+        self.errors: Dict[Proxy, int] = {}
+
+    def trace_config(self, proxy: Optional[Proxy] = None) \
+            -> aiohttp.TraceConfig:
+        """
+        Returns TraceConfig of session for `proxy`.
+        :param proxy:
+        :return:
+        """
+        config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.started = time.perf_counter()
+            context.host = params.url.host or ''
+
+        async def on_request_headers_sent(session, context, params):
+            self._record(proxy, context, 'request_sent',
+                         time.perf_counter() - context.started)
+
+        async def on_request_end(session, context, params):
+            self._record(proxy, context, 'first_byte',
+                         time.perf_counter() - context.started)
+
+        async def on_request_exception(session, context, params):
+            if proxy is not None:
+                self.errors[proxy] = self.errors.get(proxy, 0) + 1
+
+        config.on_request_start.append(on_request_start)
+        config.on_request_headers_sent.append(on_request_headers_sent)
+        config.on_request_end.append(on_request_end)
+        config.on_request_exception.append(on_request_exception)
+        for phase, start, end in (
+                ('dns', config.on_dns_resolvehost_start,
+                 config.on_dns_resolvehost_end),
+                ('acquire', config.on_connection_queued_start,
+                 config.on_connection_queued_end),
+                ('connect', config.on_connection_create_start,
+                 config.on_connection_create_end)):
+            start.append(self._phase_start(phase))
+            end.append(self._phase_end(proxy, phase))
+        return config
+
+    def slowest_proxies(self, phase: str = 'first_byte', count: int = 10,
+                        min_requests: int = 10) -> List[Tuple[Proxy, float]]:
+        """
+        Proxies with highest moving average of `phase` duration,
+        proxies with less than `min_requests` measurements are skipped.
+        :param phase:
+        :param count:
+        :param min_requests:
+        :return:
+        """
+        latencies = [
+            (proxy, phases[phase].latency)
+            for proxy, phases in self.proxies.items()
+            if phase in phases and phases[phase].count >= min_requests
+        ]
+        latencies.sort(key=lambda item: item[1], reverse=True)
+        return latencies[:count]
+
+    @staticmethod
+    def _phase_start(phase: str):
+        """
+
+        :param phase:
+        :return:
+        """
+        async def hook(session, context, params):
+            setattr(context, phase, time.perf_counter())
+        return hook
+
+    def _phase_end(self, proxy: Optional[Proxy], phase: str):
+        """
+
+        :param proxy:
+        :param phase:
+        :return:
+        """
+        async def hook(session, context, params):
+            started = getattr(context, phase, None)
+            if started is not None:
+                self._record(proxy, context, phase,
+                             time.perf_counter() - started)
+        return hook
+
+    def _record(self, proxy: Optional[Proxy], context: SimpleNamespace,
+                phase: str, duration: float) -> None:
+        """
+
+        :param proxy:
+        :param context:
+        :param phase:
+        :param duration:
+        :return:
+        """
+        targets = [self.hosts.setdefault(getattr(context, 'host', ''), {})]
+        if proxy is not None:
+            targets.append(self.proxies.setdefault(proxy, {}))
+        for phases in targets:
+            if phase not in phases:
+                phases[phase] = PhaseStats()
+            phases[phase].update(self._alpha, duration)
@@ -2,10 +2,11 @@
 Type definition
 """
 
-from typing import TypeVar, Optional, Tuple
+from typing import TypeVar, Optional, Tuple, Callable, Awaitable
 import aiohttp
 
 KT = TypeVar('KT')
 VT = TypeVar('VT')
 Proxy = str
 Session = Tuple[Optional[Proxy], aiohttp.ClientSession]
+Sink = Callable[[KT, VT], Awaitable[None]]
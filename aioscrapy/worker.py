@@ -2,22 +2,48 @@
 worker module.
 """
 import asyncio
+import heapq
+import multiprocessing
+import os
+import pickle
+import queue
+import time
 from abc import ABC, abstractmethod
-from typing import Generic, List, Dict, Iterable, Set
+from collections import deque
+from typing import (
+    Generic, List, Dict, Iterable, Set, Deque, Optional, Callable, Any,
+    AsyncIterator, Tuple, Hashable, Union)
 
-from .client import Client, CrawlerClient, FetchError
-from .typedefs import KT, VT
+from .client import Client, CrawlerClient, FetchError, url_host
+from .metrics import Registry, Counter, registry_or_null
+from .typedefs import KT, VT, Sink
 
 
 class Dispatcher(Generic[KT]):
     """
     Handles tasks.
+
+    `seen` stores every key ever added, it is a set by default.
+    FingerprintSet or BloomFilter may be passed instead
+    to keep memory usage low on large crawls.
     """
 
-    def __init__(self, state: Iterable[KT]):
-        self._done: Set[KT] = set()
-        self._new: List[KT] = list(set(state))
-        self._all: Set[KT] = set(state)
+    def __init__(self, state: Iterable[KT], done: Iterable[KT] = (),
+                 seen: Optional[Any] = None):
+        self._all: Any = set() if seen is None else seen
+        self._done = 0
+        self._new: List[KT] = []
+        self._taken: Set[KT] = set()
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        for key in done:
+            if key not in self._all:
+                self._all.add(key)
+                self._done += 1
+        for key in state:
+            if key not in self._all:
+                self._all.add(key)
+                self._push(key)
 
     def add(self, key: KT):
         """
@@ -27,7 +53,8 @@ class Dispatcher(Generic[KT]):
         """
         if key not in self._all:
             self._all.add(key)
-            self._new.append(key)
+            self._push(key)
+            self._wakeup_next()
 
     def ack(self, key: KT):
         """
@@ -35,21 +62,374 @@ class Dispatcher(Generic[KT]):
         :param key:
         :return:
         """
-        if key in self._all and key not in self._done:
-            self._done.add(key)
+        if key in self._taken:
+            self._taken.remove(key)
+            self._done += 1
+            if self.empty():
+                self._wakeup_all()
 
     def get(self) -> KT:
         """
         Raises IndexError if there are no tasks left.
         """
-        return self._new.pop()
+        key = self._pop()
+        self._taken.add(key)
+        return key
+
+    async def next(self) -> KT:
+        """
+        Waits until a task is available.
+
+        Raises IndexError when all tasks are done.
+        """
+        while True:
+            try:
+                key = self.get()
+            except IndexError:
+                if self.empty():
+                    raise IndexError("No tasks left")
+            else:
+                if self._waiters:
+                    self._schedule()
+                return key
+            loop = asyncio.get_running_loop()
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            self._schedule()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                waiter.cancel()
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                if not waiter.cancelled():
+                    self._wakeup_next()
+                raise
 
     def empty(self) -> bool:
         """
 
         :return:
         """
-        return len(self._done) == len(self._all)
+        return self._done == len(self._all)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Number of keys: all seen, new in the frontier,
+        taken by workers and done.
+        :return:
+        """
+        size = len(self._all)
+        return {
+            'all': size,
+            'new': size - self._done - len(self._taken),
+            'taken': len(self._taken),
+            'done': self._done,
+        }
+
+    def _push(self, key: KT) -> None:
+        """
+        Puts new key into the frontier.
+        :param key:
+        :return:
+        """
+        self._new.append(key)
+
+    def _pop(self) -> KT:
+        """
+        Takes next key from the frontier.
+
+        Raises IndexError if there are no keys ready.
+        """
+        return self._new.pop()
+
+    def _delay(self) -> Optional[float]:
+        """
+        Seconds until a queued key becomes ready, None if unknown.
+        :return:
+        """
+        return None
+
+    def _schedule(self) -> None:
+        """
+        Keeps one timer which wakes up a waiter
+        when the next queued key becomes ready.
+        :return:
+        """
+        delay = self._delay()
+        if delay is None:
+            return
+        loop = asyncio.get_running_loop()
+        when = loop.time() + delay
+        if self._timer is not None:
+            if self._timer.when() <= when:
+                return
+            self._timer.cancel()
+        self._timer = loop.call_at(when, self._on_timer)
+
+    def _on_timer(self) -> None:
+        """
+
+        :return:
+        """
+        self._timer = None
+        self._wakeup_next()
+
+    def _wakeup_next(self) -> None:
+        """
+        Wakes up one coroutine waiting in next().
+        :return:
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def _wakeup_all(self) -> None:
+        """
+        Wakes up all coroutines waiting in next().
+        :return:
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class HostDispatcher(Dispatcher[str]):
+    """
+    Keeps a queue per host and takes keys from hosts in round-robin order.
+
+    Every host is given at most one key per `delay` seconds,
+    `delays` overrides it for specific hosts.
+    """
+
+    PRUNE_SIZE = 1024
+
+    def __init__(self, state: Iterable[str], delay: float = 0.0,
+                 delays: Optional[Dict[str, float]] = None,
+                 host: Callable[[str], str] = url_host):
+        self._host = host
+        self._default_delay = delay
+        self._delays = delays or {}
+        self._queues: Dict[str, Deque[str]] = {}
+        # hosts with queued keys are either ready in the ring
+        # or waiting for their delay in the heap
+        self._ring: Deque[str] = deque()
+        self._delayed: List[Tuple[float, str]] = []
+        self._ready_at: Dict[str, float] = {}
+        self._prune_at = self.PRUNE_SIZE
+        super().__init__(state)
+
+    def _push(self, key: str) -> None:
+        """
+
+        :param key:
+        :return:
+        """
+        host = self._host(key)
+        if host not in self._queues:
+            self._queues[host] = deque()
+            ready_at = self._ready_at.get(host)
+            if ready_at is not None and ready_at > time.monotonic():
+                heapq.heappush(self._delayed, (ready_at, host))
+            else:
+                self._ring.append(host)
+        self._queues[host].append(key)
+
+    def _pop(self) -> str:
+        """
+
+        :return:
+        """
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, host = heapq.heappop(self._delayed)
+            self._ready_at.pop(host, None)
+            self._ring.append(host)
+        if not self._ring:
+            raise IndexError("No hosts ready")
+        host = self._ring.popleft()
+        queue = self._queues[host]
+        key = queue.popleft()
+        delay = self._delays.get(host, self._default_delay)
+        if delay > 0:
+            self._ready_at[host] = now + delay
+            if queue:
+                heapq.heappush(self._delayed, (now + delay, host))
+            if len(self._ready_at) >= self._prune_at:
+                self._prune(now)
+        elif queue:
+            self._ring.append(host)
+        if not queue:
+            del self._queues[host]
+        return key
+
+    def _prune(self, now: float) -> None:
+        """
+        Forgets hosts whose delay has passed,
+        runs again when the table doubles.
+        :param now:
+        :return:
+        """
+        self._ready_at = {
+            host: ready_at for host, ready_at in self._ready_at.items()
+            if ready_at > now
+        }
+        self._prune_at = max(self.PRUNE_SIZE, 2 * len(self._ready_at))
+
+    def _delay(self) -> Optional[float]:
+        """
+
+        :return:
+        """
+        if self._ring:
+            return 0.0
+        if not self._delayed:
+            return None
+        return max(self._delayed[0][0] - time.monotonic(), 0.0)
+
+
+class JournalDispatcher(Dispatcher[str]):
+    """
+    Dispatcher which survives restarts.
+
+    Every add and ack is appended to the journal at `path`.
+    The whole state is written to `path.snapshot` and the journal
+    is truncated once the journal holds at least `snapshot_every` records
+    and at least `snapshot_ratio` records per known key, so snapshots
+    of a large state are rare and their writes stay proportional
+    to journal writes.
+    """
+
+    ADD = '+'
+    ACK = '-'
+
+    def __init__(self, path: str, state: Iterable[str] = (),
+                 snapshot_every: int = 100000, snapshot_ratio: float = 0.5):
+        self._path = path
+        self._snapshot_path = path + '.snapshot'
+        self._snapshot_every = snapshot_every
+        self._snapshot_ratio = snapshot_ratio
+        keys: Set[str] = set()
+        done: Set[str] = set()
+        self._replay(self._snapshot_path, keys, done)
+        end, self._records = self._replay(self._path, keys, done)
+        super().__init__(keys, done)
+        if end is not None and end < os.path.getsize(self._path):
+            os.truncate(self._path, end)
+        self._journal = open(self._path, 'a', encoding='utf-8')
+        for key in state:
+            self.add(key)
+
+    def add(self, key: str):
+        """
+
+        :param key:
+        :return:
+        """
+        if '\n' in key:
+            raise ValueError("key must not contain newlines")
+        if key not in self._all:
+            super().add(key)
+            self._write(self.ADD, key)
+
+    def ack(self, key: str):
+        """
+
+        :param key:
+        :return:
+        """
+        if key in self._taken:
+            super().ack(key)
+            self._write(self.ACK, key)
+
+    def snapshot(self) -> None:
+        """
+        Writes the whole state to the snapshot file and truncates journal.
+        :return:
+        """
+        tmp_path = self._snapshot_path + '.tmp'
+        pending = self._taken.union(self._new)
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            for key in self._all:
+                mark = self.ADD if key in pending else self.ACK
+                file.write(f'{mark}{key}\n')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self._snapshot_path)
+        self._journal.close()
+        self._journal = open(self._path, 'w', encoding='utf-8')
+        self._records = 0
+
+    def flush(self) -> None:
+        """
+        Flushes journal to disk.
+        :return:
+        """
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def close(self) -> None:
+        """
+
+        :return:
+        """
+        if not self._journal.closed:
+            self.flush()
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write(self, mark: str, key: str) -> None:
+        """
+
+        :param mark:
+        :param key:
+        :return:
+        """
+        self._journal.write(f'{mark}{key}\n')
+        self._records += 1
+        if self._records >= self._snapshot_every and \
+                self._records >= self._snapshot_ratio * len(self._all):
+            self.snapshot()
+
+    @classmethod
+    def _replay(cls, path: str, keys: Set[str], done: Set[str]) \
+            -> Tuple[Optional[int], int]:
+        """
+        Applies records from file, a torn last line is ignored.
+
+        Returns size of complete records in bytes, None if there is no file,
+        and number of records.
+        :param path:
+        :param keys:
+        :param done:
+        :return:
+        """
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            return None, 0
+        end = 0
+        records = 0
+        with file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break
+                end += len(line)
+                records += 1
+                record = line[:-1].decode('utf-8')
+                mark, key = record[0], record[1:]
+                keys.add(key)
+                if mark == cls.ACK:
+                    done.add(key)
+        return end, records
 
 
 class Worker(ABC, Generic[KT, VT]):
@@ -64,8 +444,49 @@ class Worker(ABC, Generic[KT, VT]):
         :return:
         """
 
+    async def feed(self, sink: Sink[KT, VT]) -> None:
+        """
+        Passes every result to sink instead of collecting them.
+        :param sink:
+        :return:
+        """
+        for key, value in (await self.run()).items():
+            await sink(key, value)
+
+    async def stream(self, maxsize: int = 100) \
+            -> AsyncIterator[Tuple[KT, VT]]:
+        """
+        Yields results as soon as they are fetched.
+
+        At most `maxsize` results are buffered,
+        fetching is paused until the consumer catches up.
+        :param maxsize:
+        :return:
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+        async def put(key: KT, value: VT) -> None:
+            await queue.put((key, value))
 
-class Master(Generic[KT, VT]):
+        async def produce() -> None:
+            try:
+                await self.feed(put)
+            finally:
+                await queue.put(None)
+
+        task = asyncio.ensure_future(produce())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                yield item
+            await task
+        finally:
+            task.cancel()
+
+
+class Master(Worker[KT, VT]):
     """
     Runs multiple Workers together
     """
@@ -86,16 +507,42 @@ class Master(Generic[KT, VT]):
             result.update(worker_result)
         return result
 
+    async def feed(self, sink: Sink[KT, VT]) -> None:
+        """
+
+        :param sink:
+        :return:
+        """
+        await asyncio.gather(*[
+            worker.feed(sink) for worker in self._workers
+        ])
+
+
+def worker_errors(metrics: Registry) -> Counter:
+    """
+    Counter of FetchErrors skipped by workers.
+    :param metrics:
+    :return:
+    """
+    return metrics.counter(
+        'aioscrapy_worker_errors_total', "Keys failed with FetchError",
+        ('error',))
+
 
 class CrawlerWorker(Worker[KT, VT]):
     """
     CrawlerWorker
+
+    Keys failed with FetchError are skipped,
+    errors are counted in `metrics` by error class.
     """
 
     def __init__(self, dispatcher: Dispatcher[KT],
-                 client: CrawlerClient[KT, VT]):
+                 client: CrawlerClient[KT, VT],
+                 metrics: Optional[Registry] = None):
         self._dispatcher = dispatcher
         self._client = client
+        self._errors = worker_errors(registry_or_null(metrics))
 
     async def run(self) -> Dict[KT, VT]:
         """
@@ -103,33 +550,48 @@ class CrawlerWorker(Worker[KT, VT]):
         :return:
         """
         results: Dict[KT, VT] = {}
-        while not self._dispatcher.empty():
-            try:
-                key = self._dispatcher.get()
-            except IndexError:
-                await asyncio.sleep(0.05)
-            else:
-                try:
-                    new_keys, result = await self._client.fetch(key)
-                    for new_key in new_keys:
-                        self._dispatcher.add(new_key)
-                    results[key] = result
-                except FetchError:
-                    pass
-                finally:
-                    self._dispatcher.ack(key)
 
+        async def collect(key: KT, value: VT) -> None:
+            results[key] = value
+
+        await self.feed(collect)
         return results
 
+    async def feed(self, sink: Sink[KT, VT]) -> None:
+        """
+
+        :param sink:
+        :return:
+        """
+        while True:
+            try:
+                key = await self._dispatcher.next()
+            except IndexError:
+                break
+            try:
+                new_keys, result = await self._client.fetch(key)
+                for new_key in new_keys:
+                    self._dispatcher.add(new_key)
+                await sink(key, result)
+            except FetchError as error:
+                self._errors.inc(type(error).__name__)
+            finally:
+                self._dispatcher.ack(key)
+
 
 class SimpleWorker(Worker[KT, VT]):
     """
     SimpleWorker
+
+    Keys failed with FetchError are skipped,
+    errors are counted in `metrics` by error class.
     """
 
-    def __init__(self, dispatcher: Dispatcher[KT], client: Client[KT, VT]):
+    def __init__(self, dispatcher: Dispatcher[KT], client: Client[KT, VT],
+                 metrics: Optional[Registry] = None):
         self._dispatcher = dispatcher
         self._client = client
+        self._errors = worker_errors(registry_or_null(metrics))
 
     async def run(self) -> Dict[KT, VT]:
         """
@@ -137,18 +599,229 @@ class SimpleWorker(Worker[KT, VT]):
         :return:
         """
         results: Dict[KT, VT] = {}
-        while not self._dispatcher.empty():
+
+        async def collect(key: KT, value: VT) -> None:
+            results[key] = value
+
+        await self.feed(collect)
+        return results
+
+    async def feed(self, sink: Sink[KT, VT]) -> None:
+        """
+
+        :param sink:
+        :return:
+        """
+        while True:
             try:
-                key = self._dispatcher.get()
+                key = await self._dispatcher.next()
             except IndexError:
-                await asyncio.sleep(0.05)
-            else:
+                break
+            try:
+                await sink(key, await self._client.fetch(key))
+            except FetchError as error:
+                self._errors.inc(type(error).__name__)
+            finally:
+                self._dispatcher.ack(key)
+
+
+class ProcessMaster(Worker[KT, VT]):
+    """
+    Runs clients in `processes` child processes, each with its own
+    event loop, while the Dispatcher stays in the parent process.
+
+    `client_factory` must be picklable, it is called once in every
+    child to build its Client, or CrawlerClient if `crawl` is True.
+    Keys are routed to children by hash of `shard(key)`, so with
+    `shard=url_host` every host is served by one process.
+    A child fetches up to `batch_size` keys concurrently and starts
+    a new fetch as soon as one finishes. At most `max_in_flight` keys,
+    4 * processes * batch_size by default, are sent to children
+    and not yet returned, a slow shard does not block routing to others
+    until it holds all of them. Results and new keys must be picklable.
+    """
+
+    def __init__(self, dispatcher: Dispatcher[KT],
+                 client_factory: Callable[
+                     [], Union[Client[KT, VT], CrawlerClient[KT, VT]]],
+                 processes: Optional[int] = None, batch_size: int = 10,
+                 crawl: bool = False,
+                 shard: Optional[Callable[[KT], Hashable]] = None,
+                 max_in_flight: Optional[int] = None):
+        self._dispatcher = dispatcher
+        self._client_factory = client_factory
+        self._processes = processes or os.cpu_count() or 1
+        self._batch_size = batch_size
+        self._crawl = crawl
+        self._shard = shard
+        self._max_in_flight = max_in_flight or \
+            4 * self._processes * batch_size
+
+    async def run(self) -> Dict[KT, VT]:
+        """
+
+        :return:
+        """
+        results: Dict[KT, VT] = {}
+
+        async def collect(key: KT, value: VT) -> None:
+            results[key] = value
+
+        await self.feed(collect)
+        return results
+
+    async def feed(self, sink: Sink[KT, VT]) -> None:
+        """
+
+        :param sink:
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context()
+        results = context.Queue()
+        tasks = [context.Queue() for _ in range(self._processes)]
+        children = [
+            context.Process(
+                target=_process_main, daemon=True,
+                args=(self._client_factory, task_queue, results,
+                      self._crawl, self._batch_size))
+            for task_queue in tasks
+        ]
+        for child in children:
+            child.start()
+        capacity = asyncio.Semaphore(self._max_in_flight)
+
+        async def route() -> None:
+            while True:
+                await capacity.acquire()
                 try:
-                    results[key] = await self._client.fetch(key)
-                    self._dispatcher.ack(key)
-                except FetchError:
-                    pass
+                    key = await self._dispatcher.next()
+                except IndexError:
+                    capacity.release()
+                    break
+                shard = key if self._shard is None else self._shard(key)
+                tasks[hash(shard) % len(tasks)].put(key)
+
+        reading: List[asyncio.Future] = []
+
+        async def collect() -> None:
+            while True:
+                reading[:] = [loop.run_in_executor(
+                    None, results.get, True, 1.0)]
+                try:
+                    data = await asyncio.shield(reading[0])
+                except queue.Empty:
+                    for child in children:
+                        if not child.is_alive():
+                            raise RuntimeError(
+                                f"Process {child.pid} exited "
+                                f"with code {child.exitcode}")
+                    continue
+                if data is None:
+                    break
+                key, fetched, new_keys, value, error = pickle.loads(data)
+                capacity.release()
+                if error is not None:
+                    raise error
+                for new_key in new_keys:
+                    self._dispatcher.add(new_key)
+                try:
+                    if fetched:
+                        await sink(key, value)
                 finally:
                     self._dispatcher.ack(key)
 
-        return results
+        router = asyncio.ensure_future(route())
+        collector = asyncio.ensure_future(collect())
+        finished = False
+        try:
+            await asyncio.wait(
+                [router, collector], return_when=asyncio.FIRST_COMPLETED)
+            if collector.done():
+                collector.result()
+            router.result()
+            finished = True
+        finally:
+            router.cancel()
+            collector.cancel()
+            results.put(None)
+            for task_queue in tasks:
+                task_queue.put(None)
+            for child in children:
+                if not finished:
+                    child.kill()
+                await loop.run_in_executor(None, child.join)
+            # the reader thread must leave results.get before close
+            await asyncio.gather(collector, *reading, return_exceptions=True)
+            for mp_queue in tasks + [results]:
+                mp_queue.close()
+                mp_queue.cancel_join_thread()
+
+
+def _process_main(client_factory: Callable[[], Any],
+                  tasks: Any, results: Any,
+                  crawl: bool, concurrency: int) -> None:
+    """
+    Entry point of ProcessMaster child process.
+    :param client_factory:
+    :param tasks:
+    :param results:
+    :param crawl:
+    :param concurrency:
+    :return:
+    """
+    asyncio.run(_process_loop(
+        client_factory, tasks, results, crawl, concurrency))
+
+
+async def _process_loop(client_factory: Callable[[], Any],
+                        tasks: Any, results: Any,
+                        crawl: bool, concurrency: int) -> None:
+    """
+    Fetches keys from tasks queue, up to `concurrency` at once,
+    until None is received. Results are pickled here,
+    so a result which cannot be pickled is reported as an error.
+    :param client_factory:
+    :param tasks:
+    :param results:
+    :param crawl:
+    :param concurrency:
+    :return:
+    """
+    loop = asyncio.get_running_loop()
+    client = client_factory()
+    semaphore = asyncio.Semaphore(concurrency)
+    running: Set[asyncio.Future] = set()
+
+    async def fetch(key: Any) -> None:
+        result: Tuple[Any, bool, List[Any], Any, Optional[Exception]]
+        try:
+            value = await client.fetch(key)
+            new_keys: List[Any] = []
+            if crawl:
+                keys, value = value
+                new_keys = list(keys)
+            result = (key, True, new_keys, value, None)
+        except FetchError:
+            result = (key, False, [], None, None)
+        except Exception as error:  # pylint: disable=broad-except
+            result = (key, False, [], None, error)
+        finally:
+            semaphore.release()
+        try:
+            data = pickle.dumps(result)
+        except Exception as error:  # pylint: disable=broad-except
+            data = pickle.dumps((key, False, [], None, RuntimeError(
+                f"Cannot pickle result of {key!r}: {error!r}")))
+        results.put(data)
+
+    while True:
+        key = await loop.run_in_executor(None, tasks.get)
+        if key is None:
+            break
+        await semaphore.acquire()
+        task = asyncio.ensure_future(fetch(key))
+        running.add(task)
+        task.add_done_callback(running.discard)
+    if running:
+        await asyncio.wait(running)
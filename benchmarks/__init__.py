@@ -0,0 +1,3 @@
+"""
+aioscrapy benchmarks
+"""
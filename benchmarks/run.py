@@ -0,0 +1,367 @@
+"""
+End-to-end benchmarks
+
+    python -m benchmarks.run --requests 2000 --output bench_output.json
+
+Every scenario runs in a fresh process and fetches pages from a local
+server running in the parent process. Reports requests/sec, p50/p99
+fetch latency, CPU time and peak RSS of the scenario process and of
+processes it started (children_*) as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import re
+import sys
+import tempfile
+import time
+from typing import (
+    List, Tuple, Iterable, Dict, Any, Callable, Awaitable, Optional)
+
+from aioscrapy import (
+    Client, CrawlerClient, WebClient, CacheClient, AsyncFileCache,
+    SessionPool, SingleSessionPool, ProxySessionPool, ProxyPool,
+    Dispatcher, SimpleWorker, CrawlerWorker, Master, ProcessMaster
+)
+from aioscrapy.client import FetchError, FakeClient
+
+from .server import Server, ServerConfig
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+LINK_RE = re.compile(rb'href="([^"]+)"')
+
+SCENARIOS = [
+    'simple_worker', 'crawler_worker', 'process_master',
+    'proxy_session_pool', 'cache_client_cold', 'cache_client_warm',
+]
+
+
+class PageClient(Client[str, bytes]):
+    """
+    Returns body, non 2xx statuses raise FetchError.
+    """
+
+    def __init__(self, session_pool: SessionPool):
+        self._client = WebClient(session_pool, raise_for_status=True)
+
+    async def fetch(self, key: str) -> bytes:
+        """
+
+        :param key:
+        :return:
+        """
+        response = await self._client.fetch(key)
+        return await response.read()
+
+
+class TimedClient(Client[str, Any]):
+    """
+    Records latency of every fetch.
+    """
+
+    def __init__(self, client: Client[str, Any]):
+        self._client = client
+        self.latencies: List[float] = []
+        self.requests = 0
+        self.errors = 0
+
+    async def fetch(self, key: str) -> Any:
+        """
+
+        :param key:
+        :return:
+        """
+        self.requests += 1
+        started = time.perf_counter()
+        try:
+            return await self._client.fetch(key)
+        except FetchError:
+            self.errors += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+
+
+class LinkClient(CrawlerClient[str, int]):
+    """
+    Extracts links from pages, returns page size.
+    """
+
+    def __init__(self, client: Client[str, bytes], base: str):
+        self._client = client
+        self._base = base
+
+    async def fetch(self, key: str) -> Tuple[Iterable[str], int]:
+        """
+
+        :param key:
+        :return:
+        """
+        body = await self._client.fetch(key)
+        links = [self._base + link.decode() for link in LINK_RE.findall(body)]
+        return links, len(body)
+
+
+class ProcessClient(Client[str, int]):
+    """
+    Client built in ProcessMaster children.
+    """
+
+    def __init__(self):
+        self._client = PageClient(SingleSessionPool())
+
+    async def fetch(self, key: str) -> int:
+        """
+
+        :param key:
+        :return:
+        """
+        return len(await self._client.fetch(key))
+
+
+def percentile_ms(values: List[float], share: float) -> Optional[float]:
+    """
+    None if latencies were not recorded.
+    :param values:
+    :param share:
+    :return:
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    value = ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+    return round(value * 1000, 3)
+
+
+def cpu_and_rss(children: bool = False) -> Tuple[float, int]:
+    """
+    User and system CPU seconds and peak resident set size in KB
+    of this process, or of its finished children, zeros if unknown.
+    :param children:
+    :return:
+    """
+    if resource is None:
+        return 0.0, 0
+    usage = resource.getrusage(
+        resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    peak = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return usage.ru_utime + usage.ru_stime, peak
+
+
+async def measure(name: str, scenario: Callable[[], Awaitable[TimedClient]]
+                  ) -> Dict[str, Any]:
+    """
+    Runs scenario and collects its stats.
+
+    Called in a fresh process which runs only this scenario,
+    so CPU time and peak RSS do not include the server or other
+    scenarios. children_* cover processes started by the scenario.
+    :param name:
+    :param scenario:
+    :return:
+    """
+    cpu_started, _ = cpu_and_rss()
+    started = time.perf_counter()
+    client = await scenario()
+    seconds = time.perf_counter() - started
+    cpu, peak = cpu_and_rss()
+    children_cpu, children_peak = cpu_and_rss(children=True)
+    return {
+        'name': name,
+        'requests': client.requests,
+        'errors': client.errors,
+        'seconds': round(seconds, 4),
+        'rps': round(client.requests / seconds, 2) if seconds else 0.0,
+        'p50_ms': percentile_ms(client.latencies, 0.5),
+        'p99_ms': percentile_ms(client.latencies, 0.99),
+        'cpu_seconds': round(cpu - cpu_started, 4),
+        'peak_rss_kb': peak,
+        'children_cpu_seconds': round(children_cpu, 4),
+        'children_peak_rss_kb': children_peak,
+    }
+
+
+async def run_workers(dispatcher: Dispatcher, workers: List[Any]) -> None:
+    """
+
+    :param dispatcher:
+    :param workers:
+    :return:
+    """
+    await Master(workers).run()
+    assert dispatcher.empty()
+
+
+async def run_scenario(name: str, args: argparse.Namespace, base: str,
+                       proxies: List[str], folder: str) -> Dict[str, Any]:
+    """
+    Runs one scenario against servers started by bench().
+    :param name:
+    :param args:
+    :param base:
+    :param proxies:
+    :param folder:
+    :return:
+    """
+    urls = [f'{base}/page/{i}' for i in range(args.requests)]
+
+    async def simple_worker() -> TimedClient:
+        pool = SingleSessionPool()
+        client = TimedClient(PageClient(pool))
+        dispatcher = Dispatcher(urls)
+        await run_workers(dispatcher, [
+            SimpleWorker(dispatcher, client)
+            for _ in range(args.concurrency)
+        ])
+        await pool.session[1].close()
+        return client
+
+    async def crawler_worker() -> TimedClient:
+        pool = SingleSessionPool()
+        client = TimedClient(PageClient(pool))
+        dispatcher = Dispatcher([urls[0]])
+        await run_workers(dispatcher, [
+            CrawlerWorker(dispatcher, LinkClient(client, base))
+            for _ in range(args.concurrency)
+        ])
+        await pool.session[1].close()
+        return client
+
+    async def process_master() -> TimedClient:
+        # latency of fetches in child processes is not recorded
+        results = await ProcessMaster(
+            Dispatcher(urls), ProcessClient, args.processes,
+            batch_size=args.concurrency).run()
+        client = TimedClient(FakeClient())
+        client.requests = len(urls)
+        client.errors = len(urls) - len(results)
+        return client
+
+    async def cache_client() -> TimedClient:
+        pool = SingleSessionPool()
+        client = TimedClient(PageClient(pool))
+        async with AsyncFileCache(folder) as cache:
+            cached = TimedClient(CacheClient(client, cache))
+            dispatcher = Dispatcher(urls)
+            await run_workers(dispatcher, [
+                SimpleWorker(dispatcher, cached)
+                for _ in range(args.concurrency)
+            ])
+        await pool.session[1].close()
+        return cached
+
+    async def proxy_session_pool() -> TimedClient:
+        async with ProxySessionPool(
+                ProxyPool(proxies), len(proxies)) as pool:
+            client = TimedClient(PageClient(pool))
+            dispatcher = Dispatcher(urls)
+            await run_workers(dispatcher, [
+                SimpleWorker(dispatcher, client)
+                for _ in range(args.concurrency)
+            ])
+        return client
+
+    scenarios: Dict[str, Callable[[], Awaitable[TimedClient]]] = {
+        'simple_worker': simple_worker,
+        'crawler_worker': crawler_worker,
+        'process_master': process_master,
+        'proxy_session_pool': proxy_session_pool,
+        'cache_client_cold': cache_client,
+        'cache_client_warm': cache_client,
+    }
+    return await measure(name, scenarios[name])
+
+
+def scenario_main(connection: Any, *args: Any) -> None:
+    """
+    Entry point of the process running one scenario.
+    :param connection:
+    :param args:
+    :return:
+    """
+    connection.send(asyncio.run(run_scenario(*args)))
+    connection.close()
+
+
+async def bench(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Servers run in this process, every scenario in a fresh process.
+    :param args:
+    :return:
+    """
+    config = ServerConfig(args.latency, args.body_size, args.error_rate,
+                          args.fanout, args.requests)
+    names = args.scenarios or SCENARIOS
+    loop = asyncio.get_running_loop()
+    context = multiprocessing.get_context('spawn')
+    results = []
+    servers = [Server(config) for _ in range(args.proxies + 1)]
+    for server in servers:
+        await server.__aenter__()
+    try:
+        proxies = [proxy.url for proxy in servers[1:]]
+        with tempfile.TemporaryDirectory() as folder:
+            for name in names:
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=scenario_main,
+                    args=(sender, name, args, servers[0].url, proxies,
+                          folder))
+                process.start()
+                sender.close()
+                await loop.run_in_executor(None, process.join)
+                if not receiver.poll():
+                    raise RuntimeError(
+                        f"Scenario {name} exited with code "
+                        f"{process.exitcode}")
+                results.append(receiver.recv())
+                receiver.close()
+    finally:
+        for server in servers:
+            await server.__aexit__(None, None, None)
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'results': results,
+    }
+
+
+def main() -> None:
+    """
+
+    :return:
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--proxies', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--body-size', type=int, default=10240)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--scenarios', nargs='*', default=None)
+    parser.add_argument('--output', default=None,
+                        help="JSON file, stdout by default")
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(bench(args)), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Local HTTP server standing in for crawled sites
+"""
+
+import asyncio
+import random
+from typing import Optional
+
+from aiohttp import web
+
+
+class ServerConfig:
+    """
+    latency - seconds before response, body_size - bytes of every page,
+    error_rate - share of 503 responses, fanout - links on every page,
+    pages - total number of pages reachable by links.
+    """
+
+    def __init__(self, latency: float = 0.005, body_size: int = 10240,
+                 error_rate: float = 0.0, fanout: int = 5,
+                 pages: int = 2000, seed: int = 0):
+        self.latency = latency
+        self.body_size = body_size
+        self.error_rate = error_rate
+        self.fanout = fanout
+        self.pages = pages
+        self.seed = seed
+
+
+def make_app(config: ServerConfig) -> web.Application:
+    """
+    Page /page/N links to pages N * fanout + 1 ... N * fanout + fanout.
+    :param config:
+    :return:
+    """
+    rand = random.Random(config.seed)
+
+    async def page(request: web.Request) -> web.Response:
+        if config.latency:
+            await asyncio.sleep(config.latency)
+        if rand.random() < config.error_rate:
+            return web.Response(status=503)
+        number = int(request.match_info['number'])
+        first = number * config.fanout + 1
+        links = ''.join(
+            f'<a href="/page/{child}"></a>'
+            for child in range(first, first + config.fanout)
+            if child < config.pages
+        )
+        body = f'<html><body>{links}</body></html>'.encode()
+        body += b' ' * max(config.body_size - len(body), 0)
+        return web.Response(body=body, content_type='text/html')
+
+    app = web.Application()
+    app.router.add_get('/page/{number}', page)
+    return app
+
+
+class Server:
+    """
+    Runs app on a free localhost port.
+
+    Also serves proxied requests, so it can act as a proxy for itself.
+    """
+
+    def __init__(self, config: ServerConfig):
+        self._config = config
+        self._runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    @property
+    def url(self) -> str:
+        """
+
+        :return:
+        """
+        return f'http://127.0.0.1:{self.port}'
+
+    async def __aenter__(self):
+        self._runner = web.AppRunner(make_app(self._config),
+                                     access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -59,6 +59,9 @@ setup(
     install_requires=[
         "aiohttp",
     ],
+    extras_require={
+        "zstd": ["zstandard"],
+    },
     description=DESCRIPTION,
     long_description=long_description,
     long_description_content_type='text/markdown',
@@ -1,8 +1,11 @@
 import os
+import zlib
 
 import pytest
 
-from aioscrapy.cache import FileCache, MemoryCache
+from aioscrapy.cache import FileCache, SegmentCache, MemoryCache, WriteBehindCache, AsyncFileCache, InlineCache, \
+    ExecutorCache, to_async
+from aioscrapy.serializer import JSONSerializer, ZlibSerializer
 
 
 def test_file_cache(tmpdir: str):
@@ -34,3 +37,204 @@ def test_memory_cache():
     assert cache.get(key) == value
     with pytest.raises(LookupError):
         cache.get(fake_key)
+
+
+@pytest.mark.asyncio
+async def test_async_file_cache(tmpdir: str):
+    key = 'key'
+    value = [1, 2, 3]
+    async with AsyncFileCache(str(tmpdir), max_workers=2) as cache:
+        await cache.set(key, value)
+        assert await cache.get(key) == value
+        with pytest.raises(LookupError):
+            await cache.get('fake_key')
+    async with AsyncFileCache(str(tmpdir), serializer=ZlibSerializer(JSONSerializer())) as cache:
+        await cache.set('json', {'a': 1})
+        assert await cache.get('json') == {'a': 1}
+    with open(FileCache(str(tmpdir))._full_path('json'), 'rb') as file:
+        assert zlib.decompress(file.read()) == b'{"a":1}'
+
+
+@pytest.mark.asyncio
+async def test_inline_cache():
+    memory_cache = MemoryCache()
+    cache = to_async(memory_cache)
+    assert isinstance(cache, InlineCache)
+    assert to_async(cache) is cache
+    await cache.set('key', 'value')
+    assert memory_cache.get('key') == 'value'
+    assert await cache.get('key') == 'value'
+
+
+def test_segment_cache(tmpdir: str):
+    folder = str(tmpdir)
+    with SegmentCache(folder, segment_size=64) as cache:
+        for i in range(10):
+            cache.set(f'key{i}', [i] * 10)
+        cache.set('key0', 'new')
+        assert cache.get('key0') == 'new'
+        assert cache.get('key9') == [9] * 10
+        with pytest.raises(LookupError):
+            cache.get('fake_key')
+        assert cache.garbage() > 0
+        assert len(os.listdir(folder)) > 1
+
+    with SegmentCache(folder, segment_size=64) as cache:
+        assert cache.get('key0') == 'new'
+        assert cache.get('key5') == [5] * 10
+        cache.compact()
+        assert cache.garbage() == 0
+        assert cache.get('key0') == 'new'
+        assert cache.get('key5') == [5] * 10
+
+
+def test_segment_cache_torn_tail(tmpdir: str):
+    folder = str(tmpdir)
+    with SegmentCache(folder) as cache:
+        cache.set('key1', 'value1')
+        cache.set('key2', 'value2')
+    path = os.path.join(folder, os.listdir(folder)[0])
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as file:
+        file.truncate(size - 1)
+
+    with SegmentCache(folder) as cache:
+        assert cache.get('key1') == 'value1'
+        with pytest.raises(LookupError):
+            cache.get('key2')
+        cache.set('key2', 'value2')
+        assert cache.get('key2') == 'value2'
+
+
+def test_segment_cache_corrupt_sealed_segment(tmpdir: str):
+    folder = str(tmpdir)
+    with SegmentCache(folder, segment_size=100) as cache:
+        for i in range(6):
+            cache.set(f'key{i}', f'value{i}')
+    first = os.path.join(folder, sorted(os.listdir(folder))[0])
+    size = os.path.getsize(first)
+    with open(first, 'r+b') as file:
+        file.seek(size - 2)
+        file.write(b'X')
+
+    with SegmentCache(folder, segment_size=100) as cache:
+        assert os.path.getsize(first) == size
+        assert cache.garbage() > 0
+        missing = [i for i in range(6) if not cache.get_many([f'key{i}'])]
+        assert len(missing) == 1
+        assert cache.get('key5') == 'value5'
+
+
+def test_segment_cache_many(tmpdir: str):
+    folder = str(tmpdir)
+    items = {f'key{i}': [i] * 10 for i in range(10)}
+    with SegmentCache(folder, segment_size=64) as cache:
+        cache.set_many(items)
+        assert cache.get_many(['key1', 'key9', 'fake_key']) == {'key1': [1] * 10, 'key9': [9] * 10}
+    with SegmentCache(folder, segment_size=64) as cache:
+        assert cache.get_many(items) == items
+
+
+class CountingCache(MemoryCache):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def get_many(self, keys):
+        self.calls.append('get_many')
+        return super().get_many(keys)
+
+    def set_many(self, items):
+        self.calls.append('set_many')
+        super().set_many(items)
+
+
+@pytest.mark.asyncio
+async def test_async_cache_many(tmpdir: str):
+    memory_cache = CountingCache()
+    async with ExecutorCache(memory_cache, max_workers=2) as cache:
+        await cache.set_many({'key1': 1, 'key2': 2})
+        assert await cache.get_many(['key1', 'key2', 'key3']) == {'key1': 1, 'key2': 2}
+    assert memory_cache.calls == ['set_many', 'get_many']
+
+    async with AsyncFileCache(str(tmpdir)) as file_cache:
+        await file_cache.set_many({'key1': 1})
+        assert await file_cache.get_many(['key1', 'key2']) == {'key1': 1}
+
+
+def test_memory_cache_max_entries():
+    cache = MemoryCache(max_entries=2)
+    cache.set('key1', 1)
+    cache.set('key2', 2)
+    assert cache.get('key1') == 1
+    cache.set('key3', 3)
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    with pytest.raises(LookupError):
+        cache.get('key2')
+    assert cache.get('key1') == 1
+    assert cache.get('key3') == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_memory_cache_max_bytes():
+    cache = MemoryCache(max_bytes=10, sizeof=len)
+    cache.set('key1', b'12345')
+    cache.set('key2', b'12345')
+    assert cache.size == 10
+    cache.set('key3', b'123')
+    assert cache.size == 8
+    with pytest.raises(LookupError):
+        cache.get('key1')
+    cache.set('key4', b'12345678901')
+    with pytest.raises(LookupError):
+        cache.get('key4')
+    cache.set('key2', b'1')
+    assert cache.size == 4
+
+
+def test_memory_cache_ttl():
+    cache = MemoryCache(ttl=60)
+    cache.set('key1', 1)
+    cache.set('key2', 2, ttl=0)
+    assert cache.get('key1') == 1
+    with pytest.raises(LookupError):
+        cache.get('key2')
+    assert len(cache) == 1
+
+
+class FailingCache(MemoryCache):
+    def set(self, key, val, ttl=None):
+        if key == 'bad':
+            raise OSError()
+        super().set(key, val, ttl)
+
+
+@pytest.mark.asyncio
+async def test_write_behind_cache():
+    memory_cache = FailingCache()
+    async with WriteBehindCache(memory_cache, batch_size=2, max_pending=2) as cache:
+        for i in range(5):
+            await cache.set(f'key{i}', i)
+        await cache.set('key0', 'new')
+        assert await cache.get('key0') == 'new'
+        await cache.flush()
+        assert memory_cache.get('key0') == 'new'
+        assert memory_cache.get('key4') == 4
+
+        await cache.set('bad', 1)
+        await cache.set('key5', 5)
+        with pytest.raises(OSError):
+            await cache.flush()
+        assert memory_cache.get('key5') == 5
+        await cache.flush()
+
+
+@pytest.mark.asyncio
+async def test_write_behind_cache_batches():
+    memory_cache = CountingCache()
+    async with WriteBehindCache(memory_cache, batch_size=10) as cache:
+        await cache.set_many({f'key{i}': i for i in range(5)})
+        assert await cache.get_many(['key0', 'key4', 'key5']) == {'key0': 0, 'key4': 4}
+    assert memory_cache.calls == ['get_many', 'set_many']
+    assert memory_cache.get('key4') == 4
@@ -1,15 +1,26 @@
 import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from aioscrapy.typedefs import KT, VT, Proxy, Session
 
 import pytest
-from aiohttp import ClientResponse
+import pytest_asyncio
+from aiohttp import ClientResponse, web
+from aiohttp.test_utils import TestServer
 
 from aioscrapy import SingleSessionPool, SessionPool, ProxySessionPool, ProxyPool
 
-from aioscrapy.cache import MemoryCache, Cache
+from aioscrapy.cache import MemoryCache, Cache, AsyncFileCache
 from aioscrapy.client import Client, FakeClient, CacheClient, RetryClient, CacheOnlyClient, CacheSkipClient, \
-    WebClient, WebTextClient, WebByteClient, ImageClient, FetchError, WebFetchError, NoSessionLeftError
+    WebClient, WebTextClient, WebByteClient, ImageClient, FetchError, WebFetchError, NoSessionLeftError, \
+    RateLimitClient, AdaptiveClient, StatusFetchError, FatalFetchError, is_retryable, DownloadClient, \
+    RevalidatingClient, MetricsClient, ParseClient, ParseFetchError, OSFetchError
+from aioscrapy.limit import HostLimit, AdaptiveLimiter, RetryBudget
+from aioscrapy.metrics import Registry
+from aioscrapy.worker import Dispatcher, CrawlerWorker, Master
 
 
 class ForRetryClient(Client[str, str]):
@@ -83,6 +94,32 @@ async def test_cache_client():
     assert await client.fetch(key) == key
 
 
+@pytest.mark.asyncio
+async def test_cache_client_metrics():
+    registry = Registry()
+    client = CacheClient(FakeClient(), MemoryCache(), metrics=registry)
+    for _ in range(3):
+        await client.fetch('key')
+    snapshot = registry.snapshot()
+    assert snapshot['aioscrapy_cache_lookups_total'] == {('miss',): 1.0, ('hit',): 2.0}
+    latency = snapshot['aioscrapy_cache_seconds']
+    assert latency[('get',)].observed == 3
+    assert latency[('set',)].observed == 1
+
+
+class ReadOnlyCache(MemoryCache):
+    def set(self, key, val, ttl=None):
+        raise OSError()
+
+
+@pytest.mark.asyncio
+async def test_cache_client_hit_is_read_only():
+    cache = ReadOnlyCache()
+    MemoryCache.set(cache, 'key', 'value')
+    client = CacheClient(FakeClient(), cache)
+    assert await client.fetch('key') == 'value'
+
+
 @pytest.mark.asyncio
 async def test_cache_client_broken_cache():
     client = CacheClient(
@@ -250,3 +287,409 @@ async def test_image_client_fetch_google():
     with pytest.raises(WebFetchError):
         assert await client.fetch('https://google.com/dwqdqwdqwdqwdwdqwwd') is None
     assert isinstance(await client.fetch('https://google.com/favicon.ico'), bytes)
+
+
+@pytest.mark.asyncio
+async def test_cache_client_async_cache(tmpdir):
+    async with AsyncFileCache(str(tmpdir)) as cache:
+        client = CacheClient(FakeClient(), cache)
+        key = 'key'
+        assert await client.fetch(key) == key
+        assert await cache.get(key) == key
+        assert await CacheOnlyClient(FakeClient(), cache).fetch(key) == key
+        with pytest.raises(FetchError):
+            await CacheSkipClient(FakeClient(), cache).fetch(key)
+
+
+class CountingClient(Client[str, str]):
+    def __init__(self, fail: bool = False):
+        self.calls = 0
+        self._fail = fail
+
+    async def fetch(self, key: str) -> str:
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self._fail:
+            raise FetchError()
+        return key
+
+
+@pytest.mark.asyncio
+async def test_cache_client_single_flight():
+    counting_client = CountingClient()
+    client = CacheClient(counting_client, MemoryCache())
+    results = await asyncio.gather(*[client.fetch('key') for _ in range(5)])
+    assert results == ['key'] * 5
+    assert counting_client.calls == 1
+    assert await client.fetch('key') == 'key'
+    assert counting_client.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_client_single_flight_error():
+    counting_client = CountingClient(fail=True)
+    client = CacheClient(counting_client, MemoryCache())
+    results = await asyncio.gather(*[client.fetch('key') for _ in range(3)],
+                                   return_exceptions=True)
+    assert all(isinstance(result, FetchError) for result in results)
+    assert counting_client.calls == 1
+    with pytest.raises(FetchError):
+        await client.fetch('key')
+    assert counting_client.calls == 2
+
+
+class ConcurrencyClient(Client[str, str]):
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    async def fetch(self, key: str) -> str:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        return key
+
+
+@pytest.mark.asyncio
+async def test_fetch_many():
+    client = ConcurrencyClient()
+    keys = [f'key{i}' for i in range(10)]
+    assert await client.fetch_many(keys + ['key0'], concurrency=3) == {key: key for key in keys}
+    assert client.max_active == 3
+
+    results = await CountingClient(fail=True).fetch_many(['key'])
+    assert isinstance(results['key'], FetchError)
+
+
+class BatchCache(MemoryCache):
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def get_many(self, keys):
+        self.calls.append('get_many')
+        return super().get_many(keys)
+
+    def set_many(self, items):
+        self.calls.append(('set_many', sorted(items)))
+        super().set_many(items)
+
+
+@pytest.mark.asyncio
+async def test_cache_client_fetch_many():
+    cache = BatchCache()
+    cache.set('hit', 'cached')
+    counting_client = CountingClient()
+    registry = Registry()
+    client = CacheClient(counting_client, cache, metrics=registry)
+    in_flight = asyncio.ensure_future(client.fetch('joined'))
+    await asyncio.sleep(0)
+    results = await client.fetch_many(['hit', 'miss1', 'miss2', 'joined'])
+    assert results == {'hit': 'cached', 'miss1': 'miss1', 'miss2': 'miss2', 'joined': 'joined'}
+    assert await in_flight == 'joined'
+    assert counting_client.calls == 3
+    assert cache.calls == ['get_many', ('set_many', ['miss1', 'miss2'])]
+    assert registry.snapshot()['aioscrapy_cache_lookups_total'] == {('miss',): 4.0, ('hit',): 1.0}
+
+    results = await CacheClient(CountingClient(fail=True), cache).fetch_many(['hit', 'bad'])
+    assert results['hit'] == 'cached'
+    assert isinstance(results['bad'], FetchError)
+    results = await CacheClient(FakeClient(), BrokenCache()).fetch_many(['key'])
+    assert isinstance(results['key'], FetchError)
+
+
+@pytest.mark.asyncio
+async def test_cache_client_fetch_many_joined_by_fetch():
+    counting_client = CountingClient()
+    client = CacheClient(counting_client, MemoryCache())
+    batch = asyncio.ensure_future(client.fetch_many(['key']))
+    await asyncio.sleep(0)
+    assert await client.fetch('key') == 'key'
+    assert await batch == {'key': 'key'}
+    assert counting_client.calls == 1
+    assert not client._in_flight
+
+    client = CacheClient(CountingClient(fail=True), MemoryCache())
+    batch = asyncio.ensure_future(client.fetch_many(['bad']))
+    await asyncio.sleep(0)
+    with pytest.raises(FetchError):
+        await client.fetch('bad')
+    assert isinstance((await batch)['bad'], FetchError)
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_client():
+    inner = ConcurrencyClient()
+    client = RateLimitClient(inner, {'a.com': HostLimit(concurrency=2)})
+    keys = [f'http://a.com/{i}' for i in range(6)]
+    assert await asyncio.gather(*[client.fetch(key) for key in keys]) == keys
+    assert inner.max_active == 2
+
+    inner = ConcurrencyClient()
+    client = RateLimitClient(inner, default=HostLimit(concurrency=1))
+    keys = [f'http://host{i}.com/' for i in range(3)]
+    await asyncio.gather(*[client.fetch(key) for key in keys])
+    assert inner.max_active == 3
+
+
+class SuffixFailClient(Client[str, str]):
+    async def fetch(self, key: str) -> str:
+        if key.endswith('fail'):
+            raise FetchError()
+        return key
+
+
+@pytest.mark.asyncio
+async def test_adaptive_client():
+    client = AdaptiveClient(SuffixFailClient(), AdaptiveLimiter(initial=8),
+                            host_limiter={'initial': 4})
+    assert await client.fetch('http://a.com/ok') == 'http://a.com/ok'
+    with pytest.raises(FetchError):
+        await client.fetch('http://b.com/fail')
+    assert client.limiter.limit == 4
+    assert client.host_limits() == {'a.com': 4, 'b.com': 2}
+
+    client._prune_at = 2
+    assert await client.fetch('http://c.com/ok') == 'http://c.com/ok'
+    assert client.host_limits() == {'c.com': 4}
+
+
+class StatusClient(Client[str, str]):
+    def __init__(self, statuses, retry_after=None):
+        self._statuses = list(statuses)
+        self._retry_after = retry_after
+        self.calls = 0
+
+    async def fetch(self, key: str) -> str:
+        self.calls += 1
+        status = self._statuses.pop(0)
+        if status != 200:
+            raise StatusFetchError(status, self._retry_after)
+        return key
+
+
+@pytest.mark.asyncio
+async def test_retry_client_classification():
+    assert is_retryable(FetchError())
+    assert is_retryable(StatusFetchError(503))
+    assert not is_retryable(StatusFetchError(404))
+    assert not is_retryable(FatalFetchError())
+
+    inner = StatusClient([404, 200])
+    with pytest.raises(StatusFetchError):
+        await RetryClient(inner, 3, backoff=0).fetch('key')
+    assert inner.calls == 1
+
+    inner = StatusClient([503, 429, 200])
+    assert await RetryClient(inner, 3, backoff=0).fetch('key') == 'key'
+    assert inner.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_retry_and_metrics_client_metrics():
+    registry = Registry()
+    inner = MetricsClient(StatusClient([503, 404]), registry)
+    with pytest.raises(StatusFetchError):
+        await RetryClient(inner, 3, backoff=0, metrics=registry).fetch('http://a.com/')
+    snapshot = registry.snapshot()
+    assert snapshot['aioscrapy_retries_total'] == {('StatusFetchError',): 1.0}
+    assert snapshot['aioscrapy_fetch_errors_total'] == {('a.com', 'StatusFetchError'): 2.0}
+    assert snapshot['aioscrapy_fetches_in_flight'] == {('a.com',): 0.0}
+    assert snapshot['aioscrapy_fetch_seconds'][('a.com',)].observed == 2
+
+
+@pytest.mark.asyncio
+async def test_retry_client_retry_after():
+    inner = StatusClient([429, 200], retry_after=0.05)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    assert await RetryClient(inner, 2, backoff=0).fetch('key') == 'key'
+    assert loop.time() - started >= 0.05
+
+    inner = StatusClient([429, 200], retry_after=120)
+    with pytest.raises(StatusFetchError):
+        await RetryClient(inner, 2, max_retry_after=60).fetch('key')
+    assert inner.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_retry_client_budget():
+    budget = RetryBudget(ratio=0.2, minimum=1)
+    client = RetryClient(ForRetryClient(2), 2, backoff=0, budget=budget)
+    assert await client.fetch('key1') == 'key1'
+    with pytest.raises(FetchError):
+        await client.fetch('key2')
+    assert await client.fetch('key2') == 'key2'
+
+
+@pytest_asyncio.fixture
+async def local_server():
+    async def image(request):
+        return web.Response(body=b'x' * 1000, content_type='image/png')
+
+    async def page(request):
+        return web.Response(text='page')
+
+    async def missing(request):
+        return web.Response(status=404)
+
+    async def etag(request):
+        if request.headers.get('If-None-Match') == '"v1"':
+            return web.Response(status=304)
+        counter['full_responses'] += 1
+        return web.Response(body=b'body', headers={
+            'ETag': '"v1"', 'Cache-Control': request.query.get('cc', 'no-cache')})
+
+    app = web.Application()
+    counter = {'full_responses': 0}
+    app.router.add_get('/etag', etag)
+    app.router.add_get('/image', image)
+    app.router.add_get('/page', page)
+    app.router.add_get('/missing', missing)
+    server = TestServer(app)
+    server.counter = counter
+    await server.start_server()
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_image_client_local(local_server):
+    async with ProxySessionPool(ProxyPool([]), 0) as empty_pool:
+        with pytest.raises(NoSessionLeftError):
+            await ImageClient(empty_pool).fetch(str(local_server.make_url('/image')))
+    pool = SingleSessionPool()
+    try:
+        client = ImageClient(pool)
+        assert await client.fetch(str(local_server.make_url('/image'))) == b'x' * 1000
+        with pytest.raises(WebFetchError):
+            await client.fetch(str(local_server.make_url('/page')))
+        with pytest.raises(StatusFetchError):
+            await client.fetch(str(local_server.make_url('/missing')))
+        with pytest.raises(WebFetchError):
+            await ImageClient(pool, max_bytes=999).fetch(str(local_server.make_url('/image')))
+        assert await WebByteClient(pool, max_bytes=1000).fetch(str(local_server.make_url('/image'))) == b'x' * 1000
+    finally:
+        await pool.session[1].close()
+
+
+@pytest.mark.asyncio
+async def test_download_client(local_server, tmpdir):
+    pool = SingleSessionPool()
+    try:
+        client = DownloadClient(pool, str(tmpdir), max_bytes=1000, content_type='image')
+        path = await client.fetch(str(local_server.make_url('/image')))
+        with open(path, 'rb') as file:
+            assert file.read() == b'x' * 1000
+        with pytest.raises(WebFetchError):
+            await client.fetch(str(local_server.make_url('/page')))
+        with pytest.raises(WebFetchError):
+            await DownloadClient(pool, str(tmpdir), max_bytes=10).fetch(
+                str(local_server.make_url('/image')))
+        url = str(local_server.make_url('/image'))
+        paths = await asyncio.gather(*[client.fetch(url) for _ in range(5)])
+        assert set(paths) == {path}
+        with open(path, 'rb') as file:
+            assert file.read() == b'x' * 1000
+        os.remove(path)
+        os.makedirs(os.path.join(path, 'blocker'))
+        with pytest.raises(OSFetchError):
+            await client.fetch(url)
+        assert not any(name.endswith('.tmp') for _, _, names in os.walk(str(tmpdir)) for name in names)
+    finally:
+        await pool.session[1].close()
+
+
+@pytest.mark.asyncio
+async def test_revalidating_client(local_server):
+    pool = SingleSessionPool()
+    try:
+        cache = MemoryCache()
+        client = RevalidatingClient(pool, cache)
+        url = str(local_server.make_url('/etag'))
+        assert await client.fetch(url) == b'body'
+        assert await client.fetch(url) == b'body'
+        assert local_server.counter['full_responses'] == 1
+        assert cache.get(url).etag == '"v1"'
+
+        url = str(local_server.make_url('/etag?cc=max-age=60'))
+        assert await client.fetch(url) == b'body'
+        cache.get(url)
+        assert await client.fetch(url) == b'body'
+        assert local_server.counter['full_responses'] == 2
+
+        url = str(local_server.make_url('/etag?cc=no-store'))
+        assert await client.fetch(url) == b'body'
+        with pytest.raises(LookupError):
+            cache.get(url)
+    finally:
+        await pool.session[1].close()
+
+
+def parse_links(key: str, body: bytes):
+    if body == b'bad':
+        raise ValueError(body)
+    return body.decode().split(), len(body)
+
+
+class BodyClient(Client[str, bytes]):
+    def __init__(self, pages):
+        self._pages = pages
+        self.active = 0
+        self.max_active = 0
+
+    async def fetch(self, key: str) -> bytes:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+            return self._pages[key]
+        finally:
+            self.active -= 1
+
+
+@pytest.mark.asyncio
+async def test_parse_client():
+    body_client = BodyClient({'a': b'b c', 'b': b'', 'c': b'bad'})
+    async with ParseClient(body_client, parse_links, processes=2, max_pending=2) as client:
+        assert await client.fetch('a') == (['b', 'c'], 3)
+        with pytest.raises(ParseFetchError):
+            await client.fetch('c')
+        dispatcher = Dispatcher(['a'])
+        workers = [CrawlerWorker(dispatcher, client) for _ in range(5)]
+        assert await Master(workers).run() == {'a': 3, 'b': 0}
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__(8)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.02)
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.mark.asyncio
+async def test_parse_client_bounds_parse_jobs():
+    keys = [str(i) for i in range(8)]
+    body_client = BodyClient({key: b'' for key in keys})
+    with CountingExecutor() as executor:
+        client = ParseClient(body_client, parse_links, max_pending=2, executor=executor)
+        results = await asyncio.gather(*[client.fetch(key) for key in keys])
+    assert results == [([], 0)] * len(keys)
+    assert body_client.max_active == len(keys)
+    assert executor.max_active == 2
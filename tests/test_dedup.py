@@ -0,0 +1,51 @@
+import pytest
+
+from aioscrapy.dedup import FingerprintSet, BloomFilter
+from aioscrapy.worker import Dispatcher
+
+
+@pytest.mark.parametrize('bits', [64, 128])
+def test_fingerprint_set(bits: int):
+    seen = FingerprintSet(bits, capacity=4)
+    keys = [f'http://example.com/{i}' for i in range(1000)]
+    for key in keys:
+        seen.add(key)
+    seen.add(keys[0])
+    assert len(seen) == len(keys)
+    assert all(key in seen for key in keys)
+    assert 'http://example.com/-1' not in seen
+    assert 1 not in seen
+
+
+def test_fingerprint_set_wrong_bits():
+    with pytest.raises(ValueError):
+        FingerprintSet(32)
+
+
+def test_bloom_filter():
+    seen = BloomFilter(capacity=100, error_rate=0.01)
+    keys = [f'http://example.com/{i}' for i in range(1000)]
+    for key in keys:
+        seen.add(key)
+    assert all(key in seen for key in keys)
+    assert len(seen) <= len(keys)
+    false_positives = sum(f'http://example.org/{i}' in seen for i in range(1000))
+    assert false_positives < 20
+    with pytest.raises(ValueError):
+        BloomFilter(error_rate=1)
+
+
+@pytest.mark.parametrize('seen', [FingerprintSet(), BloomFilter()])
+def test_dispatcher_seen(seen):
+    dispatcher = Dispatcher(['key1'], seen=seen)
+    dispatcher.add('key1')
+    dispatcher.add('key2')
+    keys = {dispatcher.get(), dispatcher.get()}
+    assert keys == {'key1', 'key2'}
+    with pytest.raises(IndexError):
+        dispatcher.get()
+    dispatcher.ack('key1')
+    dispatcher.ack('key1')
+    assert dispatcher.empty() is False
+    dispatcher.ack('key2')
+    assert dispatcher.empty() is True
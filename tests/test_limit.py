@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+import pytest
+
+from aioscrapy.limit import TokenBucket, HostLimit, HostLimiter, AdaptiveLimiter
+
+
+@pytest.mark.asyncio
+async def test_token_bucket():
+    bucket = TokenBucket(rate=100, burst=2)
+    start = time.monotonic()
+    for _ in range(6):
+        await bucket.acquire()
+    assert 0.03 <= time.monotonic() - start < 0.5
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_host_limiter_patterns():
+    fast, slow = HostLimit(concurrency=10), HostLimit(concurrency=1, rate=1)
+    limiter = HostLimiter({'*.slow.com': slow, 'slow.com': slow}, default=fast)
+    assert limiter.limit('a.slow.com') == slow
+    assert limiter.limit('slow.com') == slow
+    assert limiter.limit('fast.com') == fast
+
+
+@pytest.mark.asyncio
+async def test_host_limiter_concurrency():
+    limiter = HostLimiter({'slow.com': HostLimit(concurrency=1)})
+    await limiter.acquire('slow.com')
+    waiter = asyncio.ensure_future(limiter.acquire('slow.com'))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    await asyncio.wait_for(limiter.acquire('fast.com'), 0.1)
+    limiter.release('slow.com')
+    await asyncio.wait_for(waiter, 0.1)
+
+
+class SmallHostLimiter(HostLimiter):
+    PRUNE_SIZE = 4
+
+
+@pytest.mark.asyncio
+async def test_host_limiter_prunes_idle_hosts():
+    limiter = SmallHostLimiter({'slow.com': HostLimit(rate=0.1)}, default=HostLimit(concurrency=2))
+    await limiter.acquire('busy.com')
+    await limiter.acquire('slow.com')
+    limiter.release('slow.com')
+    for i in range(100):
+        await limiter.acquire(f'host{i}.com')
+        limiter.release(f'host{i}.com')
+    await limiter.acquire('last.com')
+    assert len(limiter._semaphores) < 10
+    assert {'busy.com', 'slow.com'} <= set(limiter._semaphores)
+    limiter.release('busy.com')
+    assert limiter._in_flight == {'last.com': 1}
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter():
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=3)
+    first = await limiter.acquire()
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    limiter.release(first, ok=True)
+    started = await asyncio.wait_for(waiter, 0.1)
+    assert limiter.limit == 2
+    assert limiter.in_flight == 2
+
+    limiter.release(started, ok=False)
+    assert limiter.limit == 1
+    limiter.release(first, ok=False)
+    assert limiter.limit == 1
+
+    for _ in range(20):
+        limiter.release(await limiter.acquire(), ok=True)
+    assert limiter.limit == 3
+    with pytest.raises(ValueError):
+        AdaptiveLimiter(decrease=1)
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_latency():
+    limiter = AdaptiveLimiter(initial=4, latency_target=0.01)
+    started = await limiter.acquire()
+    await asyncio.sleep(0.02)
+    limiter.release(started)
+    assert limiter.limit == 2
@@ -0,0 +1,86 @@
+import math
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from aiohttp import web
+
+from aioscrapy.metrics import Registry, NullRegistry, HistogramValue, track_dispatcher, metrics_handler
+from aioscrapy.worker import Dispatcher
+
+
+def test_counter_and_gauge():
+    registry = Registry()
+    counter = registry.counter('requests_total', 'Requests', ('host',))
+    counter.inc('a.com')
+    counter.inc('a.com', amount=2)
+    counter.inc('b.com')
+    assert registry.counter('requests_total', labels=('host',)) is counter
+    gauge = registry.gauge('in_flight')
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert registry.snapshot() == {
+        'requests_total': {('a.com',): 3.0, ('b.com',): 1.0},
+        'in_flight': {(): 1.0},
+    }
+    with pytest.raises(ValueError):
+        registry.gauge('requests_total')
+
+
+def test_histogram():
+    registry = Registry()
+    histogram = registry.histogram('latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value)
+    assert registry.snapshot()['latency'][()] == HistogramValue(
+        4, 5.65, ((0.1, 2), (1.0, 3), (math.inf, 4)))
+
+
+def test_prometheus():
+    registry = Registry()
+    registry.counter('errors_total', 'Errors', ('error',)).inc('Bad "one"')
+    registry.histogram('latency', buckets=(1.0,)).observe(0.5)
+    assert registry.prometheus() == (
+        '# HELP errors_total Errors\n'
+        '# TYPE errors_total counter\n'
+        'errors_total{error="Bad \\"one\\""} 1.0\n'
+        '# TYPE latency histogram\n'
+        'latency_bucket{le="1.0"} 1.0\n'
+        'latency_bucket{le="+Inf"} 1.0\n'
+        'latency_sum 0.5\n'
+        'latency_count 1.0\n'
+    )
+
+
+def test_null_registry():
+    registry = NullRegistry()
+    registry.counter('a').inc()
+    registry.gauge('b').set(1)
+    registry.histogram('c').observe(1)
+    assert registry.snapshot() == {}
+
+
+def test_track_dispatcher():
+    registry = Registry()
+    dispatcher = Dispatcher(['a', 'b', 'c'])
+    track_dispatcher(registry, dispatcher)
+    dispatcher.ack(dispatcher.get())
+    dispatcher.get()
+    assert registry.snapshot()['aioscrapy_dispatcher_keys'] == {
+        ('default', 'all'): 3.0,
+        ('default', 'new'): 1.0,
+        ('default', 'taken'): 1.0,
+        ('default', 'done'): 1.0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_metrics_handler():
+    registry = Registry()
+    registry.counter('requests_total').inc()
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler(registry))
+    async with TestClient(TestServer(app)) as client:
+        response = await client.get('/metrics')
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert 'requests_total 1.0' in await response.text()
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from aioscrapy.client import FakeClient, FetchError
+from aioscrapy.pipeline import Pipeline
+from aioscrapy.worker import Dispatcher
+
+
+async def parse_prefixes(key, fetched):
+    if key == 'bad':
+        raise FetchError()
+    return ([key[:-1]] if len(key) > 1 else []), len(fetched)
+
+
+@pytest.mark.asyncio
+async def test_pipeline():
+    dispatcher = Dispatcher(['abc', 'xy', 'bad'])
+    pipeline = Pipeline(dispatcher, FakeClient(), parse_prefixes, fetchers=3, parsers=2)
+    assert await pipeline.run() == {'abc': 3, 'ab': 2, 'a': 1, 'xy': 2, 'x': 1}
+    assert dispatcher.empty()
+    fetch, parse, store = (pipeline.stats[stage] for stage in ('fetch', 'parse', 'store'))
+    assert (fetch.processed, parse.processed, parse.errors, store.processed) == (6, 5, 1, 5)
+    assert store.elapsed >= parse.elapsed >= fetch.elapsed > 0
+    assert store.throughput > 0
+
+
+@pytest.mark.asyncio
+async def test_pipeline_backpressure():
+    fetched = []
+    stored = []
+    lag = []
+
+    class RecordingClient(FakeClient):
+        async def fetch(self, key: str) -> str:
+            fetched.append(key)
+            lag.append(len(fetched) - len(stored))
+            return key
+
+    async def parse(key, fetched):
+        return [], fetched
+
+    async def slow_store(key, value):
+        await asyncio.sleep(0.001)
+        stored.append(key)
+
+    keys = [f'key{i}' for i in range(30)]
+    pipeline = Pipeline(Dispatcher(keys), RecordingClient(), parse, fetchers=2, queue_size=2)
+    await pipeline.feed(slow_store)
+    assert sorted(stored) == sorted(keys)
+    assert max(lag) <= 2 + 2 + 2 + 1 + 1
+    assert pipeline.stats['store'].utilization > 0.5
+
+
+@pytest.mark.asyncio
+async def test_pipeline_store_error():
+    async def store(key, value):
+        if key == 'b':
+            raise FetchError()
+        if key == 'c':
+            raise ValueError(key)
+
+    dispatcher = Dispatcher(['a', 'b'])
+    pipeline = Pipeline(dispatcher, FakeClient(), parse_prefixes)
+    await pipeline.feed(store)
+    assert pipeline.stats['store'].errors == 1
+    assert dispatcher.empty()
+
+    dispatcher = Dispatcher(['c'])
+    with pytest.raises(ValueError):
+        await Pipeline(dispatcher, FakeClient(), parse_prefixes).feed(store)
+    assert not dispatcher.empty()
+
+
+@pytest.mark.asyncio
+async def test_pipeline_stream():
+    pipeline = Pipeline(Dispatcher(['ab']), FakeClient(), parse_prefixes)
+    assert [item async for item in pipeline.stream(maxsize=1)] in (
+        [('ab', 2), ('a', 1)], [('a', 1), ('ab', 2)])
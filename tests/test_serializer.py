@@ -0,0 +1,78 @@
+import pytest
+
+from aioscrapy.cache import FileCache, SegmentCache
+from aioscrapy.serializer import PickleSerializer, JSONSerializer, RawSerializer, ZlibSerializer, ZstdSerializer, \
+    DecodeError
+
+
+@pytest.mark.parametrize('serializer, value', [
+    (PickleSerializer(), {'key': (1, 2)}),
+    (JSONSerializer(), {'key': [1, 2]}),
+    (RawSerializer(), b'\x00bytes'),
+    (RawSerializer(), 'text'),
+    (RawSerializer(), {'key': [1, 2]}),
+    (RawSerializer(PickleSerializer()), {1, 2}),
+    (ZlibSerializer(RawSerializer(), level=9), 'html' * 100),
+])
+def test_serializer(serializer, value):
+    data = serializer.dumps(value)
+    assert isinstance(data, bytes)
+    assert serializer.loads(data) == value
+    assert serializer.loads(memoryview(data)) == value
+
+
+def test_raw_serializer():
+    assert RawSerializer().dumps(b'bytes') == b'bbytes'
+    with pytest.raises(TypeError):
+        JSONSerializer().dumps(b'bytes')
+    with pytest.raises(ValueError):
+        RawSerializer().loads(b'xdata')
+
+
+def test_zlib_serializer_compresses():
+    value = '<html></html>' * 1000
+    assert len(ZlibSerializer(RawSerializer()).dumps(value)) < len(value) / 10
+
+
+def test_zstd_serializer():
+    pytest.importorskip('zstandard')
+    serializer = ZstdSerializer(RawSerializer(), level=3)
+    assert serializer.loads(serializer.dumps('text' * 100)) == 'text' * 100
+
+
+def test_file_cache_serializer(tmpdir):
+    cache = FileCache(str(tmpdir), ZlibSerializer(RawSerializer()))
+    cache.set('key', b'value' * 100)
+    assert cache.get('key') == b'value' * 100
+
+
+def test_segment_cache_serializer(tmpdir):
+    with SegmentCache(str(tmpdir), serializer=RawSerializer()) as cache:
+        cache.set('key', 'value')
+        assert cache.get('key') == 'value'
+
+
+@pytest.mark.parametrize('serializer, data', [
+    (PickleSerializer(), b'\x80\x05garbage'),
+    (JSONSerializer(), b'{'),
+    (RawSerializer(), b't\xff'),
+    (RawSerializer(), b'\x80\x05'),
+    (ZlibSerializer(), b'not zlib'),
+])
+def test_serializer_decode_error(serializer, data):
+    with pytest.raises(DecodeError):
+        serializer.loads(data)
+
+
+def test_cache_wrong_serializer(tmpdir):
+    FileCache(str(tmpdir.join('file'))).set('key', {'key': 1})
+    cache = FileCache(str(tmpdir.join('file')), RawSerializer())
+    with pytest.raises(LookupError):
+        cache.get('key')
+    assert cache.get_many(['key']) == {}
+    with SegmentCache(str(tmpdir.join('segment'))) as cache:
+        cache.set('key', {'key': 1})
+    with SegmentCache(str(tmpdir.join('segment')), serializer=ZlibSerializer()) as cache:
+        with pytest.raises(LookupError):
+            cache.get('key')
+        assert cache.get_many(['key']) == {}
@@ -1,6 +1,10 @@
+import asyncio
+import time
+
 import aiohttp
 import pytest
 
+from aioscrapy.metrics import Registry
 from aioscrapy.session import ProxyPool, ProxySessionPool, SingleSessionPool
 
 
@@ -85,3 +89,71 @@ async def test_single_session_pool():
     proxy, session = pool.rand()
     assert proxy is None
     assert isinstance(session, aiohttp.ClientSession)
+
+
+def test_proxy_pool_cooldown():
+    proxy1, proxy2 = '127.0.0.1:8080', '127.0.0.2:8081'
+    proxy_pool = ProxyPool([proxy1, proxy2], cooldown=0.05)
+    proxy_pool.report(proxy2, False)
+    proxy_pool.cooldown(proxy2)
+    assert {proxy_pool.rand() for _ in range(10)} == {proxy1}
+    assert proxy_pool.acquire() == proxy1
+    with pytest.raises(IndexError):
+        proxy_pool.rand()
+
+    time.sleep(0.06)
+    assert proxy_pool.rand() == proxy2
+    proxy_pool.report(proxy2, False)
+    proxy_pool.cooldown(proxy2)
+    time.sleep(0.06)
+    with pytest.raises(IndexError):
+        proxy_pool.rand()
+    time.sleep(0.05)
+    assert proxy_pool.rand() == proxy2
+
+    proxy_pool.cooldown(proxy1)
+    proxy_pool.pop(proxy1)
+    time.sleep(0.06)
+    assert {proxy_pool.rand() for _ in range(10)} == {proxy2}
+
+
+def test_proxy_pool_health():
+    proxies = [f'127.0.0.{i}:8080' for i in range(10)]
+    proxy_pool = ProxyPool(proxies)
+    for proxy in proxies[1:]:
+        proxy_pool.report(proxy, True, 5.0)
+    proxy_pool.report(proxies[0], True, 0.1)
+    assert proxy_pool.stats(proxies[0]).score() > proxy_pool.stats(proxies[1]).score()
+    picks = [proxy_pool.rand() for _ in range(1000)]
+    assert picks.count(proxies[0]) > 150
+
+
+@pytest.mark.asyncio
+async def test_proxy_session_pool_refill():
+    proxy = '127.0.0.1:8080'
+    registry = Registry()
+    async with ProxySessionPool(ProxyPool([proxy], cooldown=0.05), 1, metrics=registry) as pool:
+        pool.pop(proxy)
+        assert registry.snapshot()['aioscrapy_proxy_evictions_total'] == {(): 1.0}
+        with pytest.raises(IndexError):
+            pool.rand()
+        time.sleep(0.06)
+        assert pool.rand()[0] == proxy
+
+
+@pytest.mark.asyncio
+async def test_proxy_session_pool_closes_popped_sessions():
+    proxy1, proxy2 = '127.0.0.1:8080', '127.0.0.2:8081'
+    connector = aiohttp.TCPConnector(limit=10, ttl_dns_cache=60)
+    async with ProxySessionPool(ProxyPool([proxy1, proxy2]), 1, connector=connector) as pool:
+        proxy, session = pool.rand()
+        assert session.connector is connector
+        pool.pop(proxy)
+        await asyncio.sleep(0)
+        assert session.closed
+        assert not connector.closed
+        other_proxy, other_session = pool.rand()
+        assert other_proxy != proxy
+        assert other_session.connector is connector
+    assert other_session.closed
+    assert connector.closed
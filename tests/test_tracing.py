@@ -0,0 +1,47 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from aioscrapy.client import WebByteClient
+from aioscrapy.session import ProxyPool, ProxySessionPool, SingleSessionPool
+from aioscrapy.tracing import RequestTimings, PhaseStats
+
+
+def test_phase_stats():
+    stats = PhaseStats()
+    for duration in (1.0, 3.0):
+        stats.update(0.5, duration)
+    assert (stats.count, stats.mean, stats.max, stats.latency) == (2, 2.0, 3.0, 2.0)
+
+
+@pytest.mark.asyncio
+async def test_request_timings():
+    async def page(request):
+        return web.Response(body=b'page')
+
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', page)
+    async with TestServer(app) as server:
+        timings = RequestTimings()
+        pool = SingleSessionPool(timings=timings)
+        client = WebByteClient(pool)
+        for _ in range(2):
+            assert await client.fetch(str(server.make_url('/page'))) == b'page'
+        await pool.session[1].close()
+        host = timings.hosts[server.host]
+        assert host['first_byte'].count == 2
+        assert host['request_sent'].count == 2
+        assert host['connect'].count == 1
+        assert timings.proxies == {}
+
+        proxy = str(server.make_url(''))
+        timings = RequestTimings()
+        async with ProxySessionPool(ProxyPool([proxy]), 1, timings=timings) as pool:
+            client = WebByteClient(pool)
+            for _ in range(3):
+                assert await client.fetch('http://example.com/page') == b'page'
+        assert timings.proxies[proxy]['first_byte'].count == 3
+        assert timings.hosts['example.com']['first_byte'].count == 3
+        assert timings.slowest_proxies(min_requests=3) == [
+            (proxy, timings.proxies[proxy]['first_byte'].latency)]
+        assert timings.slowest_proxies(min_requests=4) == []
@@ -1,10 +1,13 @@
 from typing import Tuple, Iterable, List
 
 import asyncio
+import time
 import pytest
 
-from aioscrapy.client import FakeClient, CrawlerClient, FetchError
-from aioscrapy.worker import Dispatcher, SimpleWorker, CrawlerWorker, Master
+from aioscrapy.client import Client, FakeClient, CrawlerClient, FetchError
+from aioscrapy.worker import Dispatcher, HostDispatcher, JournalDispatcher, SimpleWorker, CrawlerWorker, Master, \
+    ProcessMaster, url_host
+from aioscrapy.metrics import Registry
 
 
 class ReduceStringClient(CrawlerClient[str, str]):
@@ -20,6 +23,18 @@ class SlowCrawlerClient(CrawlerClient):
         return [], key
 
 
+class SlowShardClient(Client[str, str]):
+    async def fetch(self, key: str) -> str:
+        if key == 'broken':
+            raise ValueError(key)
+        await asyncio.sleep(0.5 if key.startswith('slow') else 0.01)
+        return key
+
+
+def slow_shard(key: str) -> bool:
+    return key.startswith('slow')
+
+
 @pytest.mark.asyncio
 async def test_slow_client():
     key = '123'
@@ -81,6 +96,16 @@ async def test_simple_worker_fails():
     assert await worker.run() == {}
 
 
+@pytest.mark.asyncio
+async def test_worker_counts_errors():
+    registry = Registry()
+    dispatcher = Dispatcher(['ab'])
+    worker = CrawlerWorker(dispatcher, ReduceStringClient(), metrics=registry)
+    assert await worker.run() == {'a': 'a', 'ab': 'ab'}
+    assert registry.snapshot()['aioscrapy_worker_errors_total'] == {('FetchError',): 1.0}
+    assert dispatcher.stats() == {'all': 3, 'new': 0, 'taken': 0, 'done': 3}
+
+
 @pytest.mark.asyncio
 async def test_crawler_worker():
     keys = ['abc', 'asd']
@@ -131,3 +156,270 @@ async def test_crawler_worker_sleep_slow_client():
     master = Master((worker1, worker2))
     result = await master.run()
     assert result == {key: key for key in keys}
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_next():
+    dispatcher = Dispatcher(['key1'])
+    key = await dispatcher.next()
+    assert key == 'key1'
+
+    waiter = asyncio.ensure_future(dispatcher.next())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    dispatcher.add('key2')
+    assert await waiter == 'key2'
+
+    waiter = asyncio.ensure_future(dispatcher.next())
+    await asyncio.sleep(0)
+    dispatcher.ack('key1')
+    assert not waiter.done()
+    dispatcher.ack('key2')
+    with pytest.raises(IndexError):
+        await waiter
+    with pytest.raises(IndexError):
+        await dispatcher.next()
+
+
+def test_host_dispatcher_round_robin():
+    dispatcher = HostDispatcher([
+        'http://a.com/1', 'http://a.com/2', 'http://a.com/3',
+        'http://b.com/1',
+    ])
+    keys = [dispatcher.get() for _ in range(4)]
+    assert keys == ['http://a.com/1', 'http://b.com/1', 'http://a.com/2', 'http://a.com/3']
+    with pytest.raises(IndexError):
+        dispatcher.get()
+
+
+@pytest.mark.asyncio
+async def test_host_dispatcher_delay():
+    dispatcher = HostDispatcher(['http://a.com/1', 'http://a.com/2', 'http://b.com/1'],
+                                delay=0.1, delays={'b.com': 0})
+    assert dispatcher.get() == 'http://a.com/1'
+    assert dispatcher.get() == 'http://b.com/1'
+    with pytest.raises(IndexError):
+        dispatcher.get()
+    assert dispatcher.empty() is False
+    assert await asyncio.wait_for(dispatcher.next(), 1) == 'http://a.com/2'
+
+
+@pytest.mark.asyncio
+async def test_host_dispatcher_add_delayed_host():
+    dispatcher = HostDispatcher(['http://a.com/1', 'http://b.com/1'], delay=0.05)
+    assert dispatcher.get() == 'http://a.com/1'
+    dispatcher.add('http://a.com/2')
+    assert dispatcher.get() == 'http://b.com/1'
+    with pytest.raises(IndexError):
+        dispatcher.get()
+    assert len(dispatcher._delayed) == 1
+    assert await asyncio.wait_for(dispatcher.next(), 1) == 'http://a.com/2'
+    assert not dispatcher._delayed
+
+
+class CountingHostDispatcher(HostDispatcher):
+    PRUNE_SIZE = 2
+
+    def __init__(self, *args, **kwargs):
+        self.timers = 0
+        super().__init__(*args, **kwargs)
+
+    def _on_timer(self):
+        self.timers += 1
+        super()._on_timer()
+
+
+@pytest.mark.asyncio
+async def test_host_dispatcher_single_timer():
+    keys = [f'http://a.com/{i}' for i in range(4)]
+    dispatcher = CountingHostDispatcher(keys, delay=0.02)
+    assert dispatcher.get() == keys[0]
+    waiters = [asyncio.ensure_future(dispatcher.next()) for _ in range(10)]
+    done, pending = await asyncio.wait(waiters, timeout=0.2)
+    assert sorted(waiter.result() for waiter in done) == keys[1:]
+    assert dispatcher.timers == 3
+    for waiter in pending:
+        waiter.cancel()
+
+
+def test_host_dispatcher_prunes_ready_at():
+    dispatcher = CountingHostDispatcher(['http://a.com/1', 'http://b.com/1', 'http://c.com/1'],
+                                        delays={'a.com': 0.0001, 'b.com': 0.0001, 'c.com': 60})
+    dispatcher.get()
+    time.sleep(0.001)
+    dispatcher.get()
+    time.sleep(0.001)
+    dispatcher.get()
+    assert set(dispatcher._ready_at) == {'c.com'}
+
+
+@pytest.mark.asyncio
+async def test_host_dispatcher_worker():
+    keys = ['http://a.com/1', 'http://a.com/2', 'http://b.com/1']
+    dispatcher = HostDispatcher(keys, delay=0.01)
+    client = FakeClient()
+    master = Master([SimpleWorker(dispatcher, client) for _ in range(3)])
+    assert await master.run() == {key: key for key in keys}
+
+
+def test_dispatcher_done():
+    dispatcher = Dispatcher(['key1', 'key2'], done=['key2'])
+    assert dispatcher.get() == 'key1'
+    with pytest.raises(IndexError):
+        dispatcher.get()
+    dispatcher.add('key2')
+    dispatcher.ack('key1')
+    assert dispatcher.empty() is True
+
+
+def test_journal_dispatcher(tmpdir):
+    path = str(tmpdir.join('journal'))
+    with JournalDispatcher(path, ['key1', 'key2']) as dispatcher:
+        done_key = dispatcher.get()
+        dispatcher.add('key3')
+        dispatcher.ack(done_key)
+
+    with JournalDispatcher(path, ['key1']) as dispatcher:
+        keys = set()
+        while not dispatcher.empty():
+            key = dispatcher.get()
+            keys.add(key)
+            dispatcher.ack(key)
+        assert keys == {'key1', 'key2', 'key3'} - {done_key}
+
+    with JournalDispatcher(path) as dispatcher:
+        assert dispatcher.empty() is True
+
+
+def test_journal_dispatcher_snapshot(tmpdir):
+    path = str(tmpdir.join('journal'))
+    with JournalDispatcher(path, ['key1', 'key2', 'key3'], snapshot_every=2) as dispatcher:
+        dispatcher.ack(dispatcher.get())
+    with open(path + '.snapshot') as file:
+        assert len(file.readlines()) == 3
+    with open(path, 'a') as file:
+        file.write('+torn')
+
+    with JournalDispatcher(path) as dispatcher:
+        assert len({dispatcher.get(), dispatcher.get()}) == 2
+        with pytest.raises(IndexError):
+            dispatcher.get()
+
+
+class CountingJournalDispatcher(JournalDispatcher):
+    def __init__(self, *args, **kwargs):
+        self.snapshot_lines = 0
+        super().__init__(*args, **kwargs)
+
+    def snapshot(self):
+        self.snapshot_lines += len(self._all)
+        super().snapshot()
+
+
+def test_journal_dispatcher_snapshot_scales_with_state(tmpdir):
+    path = str(tmpdir.join('journal'))
+    keys = [f'key{i}' for i in range(1000)]
+    with CountingJournalDispatcher(path, keys, snapshot_every=1) as dispatcher:
+        while not dispatcher.empty():
+            dispatcher.ack(dispatcher.get())
+    assert dispatcher.snapshot_lines <= 2 * 2 * len(keys)
+    with open(path) as file:
+        records = len(file.readlines())
+    with JournalDispatcher(path, snapshot_every=1) as dispatcher:
+        assert dispatcher._records == records
+
+
+def test_journal_dispatcher_torn_tail(tmpdir):
+    path = str(tmpdir.join('journal'))
+    with JournalDispatcher(path, ['a', 'b']) as dispatcher:
+        pass
+    with open(path, 'a') as file:
+        file.write('+tor')
+
+    with JournalDispatcher(path) as dispatcher:
+        key = dispatcher.get()
+        dispatcher.ack(key)
+    with open(path) as file:
+        assert file.read() == f'+a\n+b\n-{key}\n'
+
+    with JournalDispatcher(path) as dispatcher:
+        assert dispatcher.stats() == {'all': 2, 'new': 1, 'taken': 0, 'done': 1}
+        assert dispatcher.get() == ({'a', 'b'} - {key}).pop()
+
+
+@pytest.mark.asyncio
+async def test_simple_worker_feed():
+    keys = ['key1', 'key2', 'key3']
+    dispatcher = Dispatcher(keys)
+    worker = SimpleWorker(dispatcher, FakeClient())
+    results = []
+
+    async def sink(key, value):
+        results.append((key, value))
+
+    await worker.feed(sink)
+    assert sorted(results) == [(key, key) for key in keys]
+
+
+@pytest.mark.asyncio
+async def test_master_stream():
+    keys = ['abc', 'asd']
+    dispatcher = Dispatcher(keys)
+    client = ReduceStringClient()
+    master = Master([CrawlerWorker(dispatcher, client) for _ in range(2)])
+    results = {}
+    async for key, value in master.stream(maxsize=1):
+        results[key] = value
+    assert results == {key: key for key in ['a', 'ab', 'abc', 'as', 'asd']}
+
+
+@pytest.mark.asyncio
+async def test_master_stream_break():
+    keys = [str(i) for i in range(10)]
+    dispatcher = Dispatcher(keys)
+    master = Master([SimpleWorker(dispatcher, FakeClient())])
+    stream = master.stream(maxsize=1)
+    async for _ in stream:
+        break
+    await stream.aclose()
+    assert dispatcher.empty() is False
+
+
+@pytest.mark.asyncio
+async def test_process_master():
+    keys = [f'http://host{i % 3}.com/{i}' for i in range(20)]
+    dispatcher = Dispatcher(keys)
+    master = ProcessMaster(dispatcher, FakeClient, processes=2, batch_size=4, shard=url_host)
+    assert await master.run() == {key: key for key in keys}
+    assert dispatcher.empty() is True
+
+
+@pytest.mark.asyncio
+async def test_process_master_crawl():
+    dispatcher = Dispatcher(['abc', 'asd'])
+    master = ProcessMaster(dispatcher, ReduceStringClient, processes=2, crawl=True)
+    results = {}
+    async for key, value in master.stream():
+        results[key] = value
+    assert results == {key: key for key in ['a', 'ab', 'abc', 'as', 'asd']}
+
+
+@pytest.mark.asyncio
+async def test_process_master_slow_shard():
+    keys = [f'slow{i}' for i in range(6)] + [f'fast{i}' for i in range(30)]
+    master = ProcessMaster(Dispatcher(keys), SlowShardClient, processes=2, batch_size=2, shard=slow_shard)
+    started = time.perf_counter()
+    done = {}
+    async for key, _ in master.stream():
+        done[key] = time.perf_counter() - started
+    assert set(done) == set(keys)
+    assert max(done[key] for key in keys if key.startswith('fast')) < \
+        min(done[key] for key in keys if key.startswith('slow'))
+
+
+@pytest.mark.asyncio
+async def test_process_master_error():
+    master = ProcessMaster(Dispatcher(['a', 'broken', 'b']), SlowShardClient, processes=2)
+    with pytest.raises(ValueError):
+        await master.run()